@@ -11,13 +11,15 @@
 # under the License.
 
 
+from password_rba_horizon.consumers import AsyncRoundTripTimeConsumer
 from password_rba_horizon.consumers import RoundTripTimeConsumer
 from password_rba_horizon.exceptions import KeystoneAdditionalStepsRequiredException
 from password_rba_horizon.forms import Login
 from password_rba_horizon.plugins import RBAPasswordPlugin
 
 
-__all__ = ['RoundTripTimeConsumer',
+__all__ = ['AsyncRoundTripTimeConsumer',
+           'RoundTripTimeConsumer',
            'KeystoneAdditionalStepsRequiredException',
            'Login',
            'RBAPasswordPlugin'
@@ -34,21 +34,30 @@ if not settings.configured:
     settings.configure()
 
 from asgiref.wsgi import WsgiToAsgi
-from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter
 from channels.routing import URLRouter
-from channels.security.websocket import AllowedHostsOriginValidator
+from django.core.asgi import get_asgi_application
 from django.core.wsgi import get_wsgi_application
+from password_rba_horizon import middleware
 from password_rba_horizon import routing
+from password_rba_horizon import warmup
+
+# Serve HTTP through Django's ASGI handler instead of wrapping the WSGI
+# application, which occupies an executor thread per request.
+if getattr(settings, 'RBA_ASGI_NATIVE_HTTP', False):
+    http_application = get_asgi_application()
+else:
+    http_application = WsgiToAsgi(get_wsgi_application())
 
 application = ProtocolTypeRouter({
-    'http': WsgiToAsgi(get_wsgi_application()),
+    'http': http_application,
     'websocket':
-    AllowedHostsOriginValidator(
-        AuthMiddlewareStack(
-            URLRouter(
-                routing.websocket_urlpatterns
-            )
-        ),
+    middleware.RTTMiddlewareStack(
+        URLRouter(
+            routing.websocket_urlpatterns
+        )
     ),
 })
+
+if getattr(settings, 'RBA_WARM_UP', True):
+    warmup.start()
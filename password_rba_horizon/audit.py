@@ -0,0 +1,139 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_AUDIT = {
+    'ENABLED': False,
+    'SINK': 'password_rba_horizon.audit.JsonLinesSink',
+    'OPTIONS': {},
+}
+
+
+class JsonLinesSink(object):
+    """Appends events to a JSON Lines file rotated by size.
+
+    Once the file exceeds ``max_bytes``, it is renamed to ``<path>.1`` and
+    older files are shifted up to ``backup_count``.
+    """
+
+    def __init__(self, path='/var/log/horizon/rba-audit.jsonl',
+                 max_bytes=50 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+
+    def _rotate(self):
+        for index in range(self.backup_count - 1, 0, -1):
+            source = '%s.%d' % (self.path, index)
+            if os.path.exists(source):
+                os.replace(source, '%s.%d' % (self.path, index + 1))
+        if self.backup_count:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+
+    def write(self, events):
+        data = ''.join(json.dumps(event, sort_keys=True) + '\n'
+                       for event in events)
+        try:
+            if os.path.getsize(self.path) + len(data) > self.max_bytes:
+                self._rotate()
+        except OSError:
+            pass
+        with open(self.path, 'a') as f:
+            f.write(data)
+
+
+class AuditLog(object):
+    """Queue of audit events written in batches by a background thread.
+
+    Recording an event never blocks the login request. Events are dropped
+    if the queue holds ``max_queue`` events. The writer flushes after
+    ``batch_size`` events or ``flush_interval`` seconds.
+    """
+
+    def __init__(self, sink, max_queue=10000, batch_size=100,
+                 flush_interval=1.0):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work,
+                                                name='rba-audit',
+                                                daemon=True)
+                self._thread.start()
+
+    def record(self, **event):
+        if self._thread is None:
+            self.start()
+        event.setdefault('timestamp', time.time())
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def _work(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self.sink.write(batch)
+            except Exception:
+                LOG.exception('Writing %d audit events failed.', len(batch))
+
+    def qsize(self):
+        return self._queue.qsize()
+
+
+def audit_enabled():
+    config = getattr(settings, 'RBA_AUDIT', DEFAULT_AUDIT)
+    return config.get('ENABLED', False)
+
+
+def create_audit_log():
+    config = getattr(settings, 'RBA_AUDIT', DEFAULT_AUDIT)
+    sink = import_string(config.get('SINK', DEFAULT_AUDIT['SINK']))
+    return AuditLog(sink(**config.get('OPTIONS', {})),
+                    **config.get('QUEUE', {}))
+
+
+audit_log = SimpleLazyObject(create_audit_log)
@@ -0,0 +1,75 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Pending RBA challenges of the sessions.
+
+The contact address and passcode of the last challenge are kept in the
+default cache for ``RBA_CHALLENGE_TTL`` seconds, so the passcode can be
+re-sent without another authentication at Keystone. Re-sending is allowed
+once every ``RBA_RESEND_INTERVAL`` seconds and at most ``RBA_RESEND_MAX``
+times per challenge.
+"""
+
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+LOG = logging.getLogger(__name__)
+
+SENT = 'sent'
+THROTTLED = 'throttled'
+MISSING = 'missing'
+
+
+def _key(session_key):
+    return 'rba_challenge:%s' % session_key
+
+
+def remember(session_key, contact, passcode):
+    if not session_key:
+        return
+    cache.set(_key(session_key),
+              {'contact': contact, 'passcode': passcode, 'resent': 0},
+              getattr(settings, 'RBA_CHALLENGE_TTL', 300))
+
+
+def forget(session_key):
+    if session_key:
+        cache.delete(_key(session_key))
+
+
+def resend(session_key, send):
+    """Re-send the passcode of the pending challenge of a session.
+
+    :param send: callable taking the contact address and the passcode.
+    :returns: ``SENT``, ``THROTTLED`` or ``MISSING``.
+    """
+    if not session_key:
+        return MISSING
+    challenge = cache.get(_key(session_key))
+    if challenge is None:
+        return MISSING
+    if challenge['resent'] >= getattr(settings, 'RBA_RESEND_MAX', 3):
+        return THROTTLED
+    if not cache.add('%s:throttle' % _key(session_key), True,
+                     getattr(settings, 'RBA_RESEND_INTERVAL', 30)):
+        return THROTTLED
+    challenge['resent'] += 1
+    cache.set(_key(session_key), challenge,
+              getattr(settings, 'RBA_CHALLENGE_TTL', 300))
+    LOG.debug('Re-sending the passcode of a pending challenge.')
+    send(challenge['contact'], challenge['passcode'])
+    return SENT
@@ -0,0 +1,162 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from keystoneauth1 import exceptions as keystone_exceptions
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_CIRCUIT_BREAKER = {
+    'ENABLED': False,
+    'OPTIONS': {},
+}
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+STATES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Connect failures, timeouts and TLS errors as well as server errors.
+FAILURES = (keystone_exceptions.ConnectionError,
+            keystone_exceptions.HttpServerError)
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class CircuitOpenError(keystone_exceptions.ConnectFailure):
+    """Keystone was not called because its circuit breaker is open."""
+
+
+class CircuitBreaker(object):
+    """Circuit breaker of one keystone endpoint.
+
+    The breaker opens after ``failure_threshold`` consecutive connection
+    errors, including timeouts, or server errors. While it is open calls fail immediately.
+    After ``recovery_timeout`` seconds it lets up to
+    ``half_open_max_calls`` trial calls through, the first success closes
+    it and a failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30,
+                 half_open_max_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.clock = time.monotonic
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.trials = 0
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        if state != self.state:
+            LOG.warning('Circuit breaker of %s changed from %s to %s.',
+                        self.name, self.state, state)
+            self.state = state
+
+    def allow(self):
+        with self._lock:
+            if (self.state == OPEN and
+                    self.clock() - self.opened_at >= self.recovery_timeout):
+                self._transition(HALF_OPEN)
+                self.trials = 0
+            if self.state == CLOSED:
+                return True
+            if (self.state == HALF_OPEN and
+                    self.trials < self.half_open_max_calls):
+                self.trials += 1
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._transition(CLOSED)
+
+    def release(self):
+        """Give back a trial call that ended without a result."""
+        with self._lock:
+            if self.state == HALF_OPEN and self.trials > 0:
+                self.trials -= 1
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if (self.state == HALF_OPEN or
+                    self.failures >= self.failure_threshold):
+                self.opened_at = self.clock()
+                self._transition(OPEN)
+
+    @contextlib.contextmanager
+    def guard(self):
+        """Context manager around one call to the endpoint.
+
+        :raises: CircuitOpenError if the breaker rejects the call
+        """
+        if not self.allow():
+            raise CircuitOpenError(
+                'Circuit breaker of %s is open.' % self.name)
+        try:
+            yield
+        except FAILURES:
+            self.record_failure()
+            raise
+        except Exception:
+            # Any other error is an answer of a reachable keystone.
+            self.record_success()
+            raise
+        except BaseException:
+            # E.g. a cancelled request, which tells nothing about keystone.
+            self.release()
+            raise
+        self.record_success()
+
+
+def circuit_breaker_enabled():
+    config = getattr(settings, 'RBA_CIRCUIT_BREAKER', DEFAULT_CIRCUIT_BREAKER)
+    return config.get('ENABLED', False)
+
+
+def get_breaker(url):
+    breaker = _breakers.get(url)
+    if breaker is None:
+        config = getattr(settings, 'RBA_CIRCUIT_BREAKER',
+                         DEFAULT_CIRCUIT_BREAKER)
+        with _breakers_lock:
+            breaker = _breakers.setdefault(
+                url, CircuitBreaker(url, **config.get('OPTIONS', {})))
+    return breaker
+
+
+def guard(url):
+    """Guard a call to ``url`` by its breaker, if breakers are enabled."""
+    if not circuit_breaker_enabled():
+        return contextlib.nullcontext()
+    return get_breaker(url).guard()
+
+
+def states():
+    return {(url,): STATES[breaker.state]
+            for url, breaker in list(_breakers.items())}
@@ -0,0 +1,126 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import logging
+import threading
+
+from django.utils.crypto import salted_hmac
+
+LOG = logging.getLogger(__name__)
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.futures = []
+        self.result = None
+        self.exception = None
+
+    def outcome(self):
+        if self.exception is not None:
+            raise self.exception
+        return self.result
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls with the same key into one call.
+
+    The first caller of a key runs the function, later callers arriving
+    while it is still running wait for and share its result or exception.
+    Waiters give up after ``timeout`` seconds and run the function
+    themselves. ``ado`` is the awaitable counterpart for coroutine
+    functions, blocking and awaiting callers of a key share one call.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, timeout=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            if call.event.wait(timeout):
+                LOG.debug('Coalesced login attempt %s', key[:8])
+                return call.outcome()
+            return func()
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as exc:
+            call.exception = exc
+            raise
+        finally:
+            self._finish(key, call)
+
+    async def ado(self, key, func, timeout=None):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                future = loop.create_future()
+                call.futures.append((loop, future))
+        if not leader:
+            try:
+                await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                return await func()
+            LOG.debug('Coalesced login attempt %s', key[:8])
+            return call.outcome()
+        try:
+            call.result = await func()
+            return call.result
+        except BaseException as exc:
+            call.exception = exc
+            raise
+        finally:
+            self._finish(key, call)
+
+    def _finish(self, key, call):
+        with self._lock:
+            del self._calls[key]
+        call.event.set()
+        for loop, future in call.futures:
+            try:
+                loop.call_soon_threadsafe(_set_done, future)
+            except RuntimeError:
+                # The loop of the waiter is closed already.
+                pass
+
+    def __len__(self):
+        return len(self._calls)
+
+
+def login_key(session_key, auth_url, username, password, domain, passcode):
+    """Return the digest identifying identical login attempts."""
+    value = '\0'.join(str(part) for part in (session_key, auth_url, username,
+                                             password, domain, passcode))
+    return salted_hmac('password_rba_horizon.coalesce', value).hexdigest()
+
+
+inflight_logins = SingleFlight()
@@ -12,63 +12,392 @@
 # implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-
+import asyncio
+import collections
 import datetime
 import json
 import logging
 import secrets
+import threading
 import time
 
+from asgiref.sync import async_to_sync
+from asgiref.sync import sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.generic.websocket import WebsocketConsumer
 from django.conf import settings
+from django.utils.crypto import constant_time_compare
+from django.utils.crypto import salted_hmac
+
+from password_rba_horizon import features
+from password_rba_horizon import metrics
+from password_rba_horizon import probes
 
 LOG = logging.getLogger(__name__)
 
 
-class RoundTripTimeConsumer(WebsocketConsumer):
-    round_trips = {}
+def summarize_rtts(rtts):
+    """Return the statistics of the measured round trips in milliseconds.
+
+    The jitter is the mean absolute difference of consecutive round trips.
+    """
+    ordered = sorted(rtts)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        median = ordered[middle]
+    else:
+        median = (ordered[middle - 1] + ordered[middle]) / 2
+    if len(rtts) > 1:
+        jitter = sum(abs(b - a) for a, b in zip(rtts, rtts[1:]))
+        jitter /= len(rtts) - 1
+    else:
+        jitter = 0.0
+    return {'min': round(ordered[0], 1),
+            'median': round(median, 1),
+            'jitter': round(jitter, 1),
+            'count': len(rtts)}
+
+
+class RoundTripTimeMixin(object):
+    """Protocol independent part of the Round-Trip-Time measurement.
+
+    The consumer sends sequence numbered random tokens to the client, which
+    echoes them back. The time between sending and receiving a token is
+    recorded as one round trip. Up to ``RBA_RTT_PIPELINE_DEPTH`` probes are
+    in flight at the same time and at most ``RBA_RTT_PROBE_COUNT`` probes
+    are sent. The measurement stops early once ``RBA_RTT_MIN_PROBES`` round
+    trips were measured and the latest one did not lower the minimum by more
+    than ``RBA_RTT_TOLERANCE`` milliseconds. Afterwards the connection is
+    closed and the statistics are handed to the login form through the
+    result store, without writing the session.
+
+    The in-flight probes are kept in ``round_trips``, the probe store
+    configured by ``RBA_RTT_PROBE_STORE``. With ``RBA_RTT_TOKEN_MODE`` set
+    to ``'signed'`` the tokens carry their sequence number and send time
+    instead, authenticated by an HMAC over both, the session key and the
+    start of the measurement on the socket. The send time counts from that
+    start. The store then only marks the measurement of the session as in
+    flight, and the socket keeps the round trips and a bit mask of the
+    echoed tokens.
+
+    A worker accepts at most ``RBA_RTT_MAX_SOCKETS`` sockets at the same
+    time, and at most ``RBA_RTT_MAX_SOCKETS_PER_IP`` of one client IP.
+    Sessions that still have an unconsumed result are refused unless
+    ``RBA_RTT_REJECT_REPEAT`` is disabled. A socket is closed
+    ``RBA_RTT_DEADLINE`` seconds after it was accepted, the round trips
+    measured until then are kept.
+    """
+    round_trips = probes.probe_store
+
+    _admission_lock = threading.Lock()
+    _sockets_by_ip = collections.Counter()
+    _sockets = 0
+
+    async def __call__(self, scope, receive, send):
+        # Synchronous consumers wrap ``send`` for their threads, the
+        # deadline closes the socket from the event loop.
+        self.loop_send = send
+        return await super().__call__(scope, receive, send)
+
+    @property
+    def session_key(self):
+        return self.scope['session'].session_key
+
+    @property
+    def client_ip(self):
+        """Client IP of the socket, honouring ``SECURE_PROXY_ADDR_HEADER``.
+        """
+        header = getattr(settings, 'SECURE_PROXY_ADDR_HEADER', False)
+        if header:
+            if header.startswith('HTTP_'):
+                header = header[5:]
+            name = header.lower().replace('_', '-').encode('latin1')
+            for key, value in self.scope.get('headers', ()):
+                if key == name:
+                    return features.proxied_address(value.decode('latin1'))
+        client = self.scope.get('client')
+        return client[0] if client else ''
+
+    def admit(self):
+        """Reserve a socket of the worker and of the client IP.
+
+        :returns: False if a limit is reached or the session has a fresh
+            result.
+        """
+        max_sockets = getattr(settings, 'RBA_RTT_MAX_SOCKETS', 1000)
+        max_per_ip = getattr(settings, 'RBA_RTT_MAX_SOCKETS_PER_IP', 20)
+        if (getattr(settings, 'RBA_RTT_REJECT_REPEAT', True) and
+                probes.result_store.has(self.session_key)):
+            metrics.RTT_REJECTED_SOCKETS.inc('fresh_result')
+            return False
+        self.admitted_ip = self.client_ip
+        cls = RoundTripTimeMixin
+        with cls._admission_lock:
+            if cls._sockets >= max_sockets:
+                reason = 'worker_limit'
+            elif cls._sockets_by_ip[self.admitted_ip] >= max_per_ip:
+                reason = 'ip_limit'
+            else:
+                cls._sockets += 1
+                cls._sockets_by_ip[self.admitted_ip] += 1
+                self.admitted = True
+                return True
+        LOG.debug('Refused RTT socket of %s: %s', self.admitted_ip, reason)
+        metrics.RTT_REJECTED_SOCKETS.inc(reason)
+        return False
+
+    def release(self):
+        """Give back the socket reserved by ``admit``.
+
+        :returns: True if the socket was admitted.
+        """
+        if not getattr(self, 'admitted', False):
+            return False
+        self.admitted = False
+        cls = RoundTripTimeMixin
+        with cls._admission_lock:
+            cls._sockets -= 1
+            cls._sockets_by_ip[self.admitted_ip] -= 1
+            if cls._sockets_by_ip[self.admitted_ip] <= 0:
+                del cls._sockets_by_ip[self.admitted_ip]
+        return True
+
+    async def arm_deadline(self):
+        """Close the socket ``RBA_RTT_DEADLINE`` seconds from now."""
+        deadline = getattr(settings, 'RBA_RTT_DEADLINE', 10)
+        if deadline:
+            self.deadline_loop = asyncio.get_running_loop()
+            self.deadline_handle = self.deadline_loop.call_later(
+                deadline, self.expire)
+
+    def expire(self):
+        self.deadline_handle = None
+        metrics.RTT_REJECTED_SOCKETS.inc('deadline')
+        asyncio.ensure_future(self.loop_send({'type': 'websocket.close'}))
+
+    def disarm_deadline(self):
+        handle = getattr(self, 'deadline_handle', None)
+        if handle is not None:
+            self.deadline_loop.call_soon_threadsafe(handle.cancel)
+            self.deadline_handle = None
+
+    def open_measurement(self):
+        # A measurement sends at least one probe at a time.
+        self.probe_count = max(1, getattr(settings, 'RBA_RTT_PROBE_COUNT', 5))
+        self.pipeline_depth = max(
+            1, getattr(settings, 'RBA_RTT_PIPELINE_DEPTH', 1))
+        self.min_probes = min(self.probe_count,
+                              getattr(settings, 'RBA_RTT_MIN_PROBES', 3))
+        self.tolerance = getattr(settings, 'RBA_RTT_TOLERANCE', None)
+        self.signed = getattr(settings, 'RBA_RTT_TOKEN_MODE',
+                              'store') == 'signed'
+        self.sent = 0
+        self.received = 0
+        self.echoed = 0
+        self.rtts = []
+        # Send times of signed tokens count from here, so the tokens do
+        # not reveal the uptime of the host.
+        self.probe_origin = time.monotonic_ns()
+        self.round_trips.open(self.session_key)
+        self.measurement_start = time.perf_counter()
+        metrics.RTT_OPEN_SOCKETS.inc()
+
+    def pending_probes(self):
+        """Return the number of probes to send to fill the pipeline."""
+        in_flight = self.sent - self.received
+        return max(0, min(self.pipeline_depth - in_flight,
+                          self.probe_count - self.sent))
+
+    def sign_probe(self, seq, start_time):
+        # The origin binds the token to the socket, it is never sent.
+        return salted_hmac('password_rba_horizon.consumers.probe',
+                           '%s.%d.%d.%d' % (self.session_key,
+                                            self.probe_origin, seq,
+                                            start_time),
+                           algorithm='sha256').hexdigest()
+
+    def new_probe(self):
+        seq = self.sent
+        self.sent += 1
+        if self.signed:
+            start_time = time.monotonic_ns() - self.probe_origin
+            token = '%d.%d.%s' % (seq, start_time,
+                                  self.sign_probe(seq, start_time))
+            return token, start_time
+        token = '%d.%s' % (seq, secrets.token_urlsafe(32))
+        return token, self.round_trips.clock()
+
+    def store_probe(self, token, start_time):
+        if not self.signed:
+            self.round_trips.add(self.session_key, token, start_time)
+
+    def verify_probe(self, text_data):
+        """Return the round trip of a signed token in milliseconds.
+
+        :raises: KeyError if the token is forged, replayed or expired.
+        """
+        end_time = time.monotonic_ns() - self.probe_origin
+        try:
+            seq, start_time, mac = text_data.split('.')
+            seq, start_time = int(seq), int(start_time)
+        except (AttributeError, ValueError):
+            raise KeyError(text_data)
+        if (not 0 <= seq < self.sent or self.echoed >> seq & 1 or
+                not constant_time_compare(
+                    mac, self.sign_probe(seq, start_time)) or
+                not 0 <= end_time - start_time <=
+                self.round_trips.ttl * 10 ** 9):
+            raise KeyError(text_data)
+        self.echoed |= 1 << seq
+        return (end_time - start_time) / 10 ** 6
+
+    def record_echo(self, text_data, end_time=None):
+        """Record the round trip of an echoed token.
+
+        :param end_time: receive time of the echo by the store clock,
+            defaults to now.
+        :returns: True if the measurement is finished.
+        :raises: KeyError if the token is unknown.
+        """
+        if self.signed:
+            rtt = self.verify_probe(text_data)
+            self.rtts.append(rtt)
+        else:
+            if end_time is None:
+                end_time = self.round_trips.clock()
+            start_time = self.round_trips.pop(self.session_key, text_data)
+            rtt = end_time - start_time
+            rtt *= 1000
+            self.rtts = self.round_trips.append_rtt(self.session_key, rtt)
+        rtts = self.rtts
+        self.received += 1
+        if len(rtts) >= self.probe_count:
+            return True
+        return (self.tolerance is not None
+                and len(rtts) >= max(2, self.min_probes)
+                and min(rtts[:-1]) - rtt <= self.tolerance)
+
+    def finish_measurement(self):
+        """Store the result and remove the records of the session.
+
+        The result is stored first, so a login that finds no record of the
+        session can rely on the result being readable.
+
+        :returns: the statistics of the round trips or None.
+        """
+        if getattr(self, 'measurement_start', None) is not None:
+            metrics.RTT_OPEN_SOCKETS.dec()
+            metrics.RTT_SECONDS.observe(
+                time.perf_counter() - self.measurement_start)
+            self.measurement_start = None
+        stats = summarize_rtts(self.rtts) if self.rtts else None
+        if stats is not None:
+            self.store_result(stats)
+        self.round_trips.discard(self.session_key)
+        return stats
+
+    def store_result(self, stats):
+        probes.result_store.put(self.session_key, stats)
+
+
+class RoundTripTimeConsumer(RoundTripTimeMixin, WebsocketConsumer):
 
     def connect(self):
-        if self.scope['session'].session_key is None:
+        if self.session_key is None or not self.admit():
             self.close()
         else:
-            self.accept()
-            self.scope['session']['rtt'] = None
-            records = self.round_trips.setdefault(
-                self.scope['session'].session_key, {})
-            records.setdefault('rtts', [])
-            self.start_measurement()
+            try:
+                self.accept()
+                async_to_sync(self.arm_deadline)()
+                self.open_measurement()
+            except BaseException:
+                self.disarm_deadline()
+                self.release()
+                raise
+            for _ in range(self.pending_probes()):
+                self.start_measurement()
 
     def start_measurement(self):
-        token = secrets.token_urlsafe(32)
-        start_time = time.perf_counter()
+        token, start_time = self.new_probe()
         self.send(token)
-        self.round_trips[self.scope['session'].session_key
-                         ].setdefault(token, start_time)
+        self.store_probe(token, start_time)
 
     def receive(self, text_data=None):
-        end_time = time.perf_counter()
         try:
-            start_time = self.round_trips[
-                self.scope['session'].session_key][text_data]
-            rtt = end_time - start_time
-            rtt *= 1000
-            self.round_trips[
-                self.scope['session'].session_key]['rtts'].append(rtt)
+            finished = self.record_echo(text_data)
         except KeyError:
             self.close()
         else:
-            if len(self.round_trips[self.scope['session'].session_key]['rtts']) < 5:
-                self.start_measurement()
-            else:
+            if finished:
                 self.close()
+            else:
+                for _ in range(self.pending_probes()):
+                    self.start_measurement()
 
     def disconnect(self, close_code):
-        if self.scope['session'].session_key is not None:
-            lowest_value = min(self.round_trips[
-                self.scope['session'].session_key]['rtts'])
-            if isinstance(lowest_value, float):
-                self.scope['session']['rtt'] = str(round(lowest_value))
-                self.scope['session'].save()
-                self.scope['session'].modified = True
-            del self.round_trips[self.scope['session'].session_key]
+        if self.release():
+            self.disarm_deadline()
+            self.finish_measurement()
+
+
+class AsyncRoundTripTimeConsumer(RoundTripTimeMixin, AsyncWebsocketConsumer):
+    """Event loop based variant of the ``RoundTripTimeConsumer``.
+
+    The token exchange and timing run on the event loop, so an open socket
+    does not occupy a thread of the synchronous executor. Enable it with
+    ``RBA_RTT_ASYNC_CONSUMER = True``. Operations of a blocking probe store,
+    like the ``CacheProbeStore``, run in a thread instead of the loop.
+    """
+
+    async def call_store(self, func, *args):
+        """Call ``func``, in a thread if the probe store is blocking."""
+        if self.round_trips.blocking:
+            return await sync_to_async(func, thread_sensitive=False)(*args)
+        return func(*args)
+
+    async def connect(self):
+        # The repeat check of admit() reads the result cache.
+        if (self.session_key is None or
+                not await sync_to_async(self.admit,
+                                        thread_sensitive=False)()):
+            await self.close()
+        else:
+            try:
+                await self.accept()
+                await self.arm_deadline()
+                await self.call_store(self.open_measurement)
+            except BaseException:
+                self.disarm_deadline()
+                self.release()
+                raise
+            for _ in range(self.pending_probes()):
+                await self.start_measurement()
+
+    async def start_measurement(self):
+        token, start_time = self.new_probe()
+        await self.send(token)
+        if not self.signed:
+            await self.call_store(self.store_probe, token, start_time)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            if self.signed:
+                finished = self.record_echo(text_data)
+            else:
+                finished = await self.call_store(
+                    self.record_echo, text_data, self.round_trips.clock())
+        except KeyError:
+            await self.close()
+        else:
+            if finished:
+                await self.close()
+            else:
+                for _ in range(self.pending_probes()):
+                    await self.start_measurement()
+
+    async def disconnect(self, close_code):
+        if self.release():
+            self.disarm_deadline()
+            # The result is always written to the cache.
+            await sync_to_async(self.finish_measurement,
+                                thread_sensitive=False)()
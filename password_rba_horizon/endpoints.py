@@ -0,0 +1,184 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Latency-aware selection among Keystone replicas of a region.
+
+``RBA_KEYSTONE_ENDPOINTS`` maps the ``auth_url`` of a region to the URLs
+of its replicas, e.g.::
+
+    RBA_KEYSTONE_ENDPOINTS = {
+        'https://keystone.example.com/v3': [
+            'https://keystone-1.example.com/v3',
+            'https://keystone-2.example.com/v3',
+        ],
+    }
+
+A background thread probes every replica periodically. Logins are sent to
+the healthy replica with the lowest smoothed health check latency first.
+Logins only report the health of a replica, not their latency, as their
+duration depends on the load of the replica rather than its distance.
+"""
+
+import logging
+import threading
+import time
+
+import requests
+
+from django.conf import settings
+
+LOG = logging.getLogger(__name__)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class Endpoint(object):
+
+    def __init__(self, url):
+        self.url = url
+        self.healthy = True
+        self.latency = 0.0
+        self.failures = 0
+
+
+class EndpointPool(object):
+    """Health and latency of the replicas of one region.
+
+    The latency is an exponentially weighted moving average of the health
+    checks with the smoothing factor ``alpha``. A replica is unhealthy
+    after a failed request or health check, until the next successful one.
+    """
+
+    def __init__(self, urls, interval=10, timeout=2, alpha=0.3):
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.interval = interval
+        self.timeout = timeout
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _endpoint(self, url):
+        for endpoint in self.endpoints:
+            if endpoint.url == url:
+                return endpoint
+
+    def ordered(self):
+        """Return the URLs, healthy ones by ascending latency first."""
+        with self._lock:
+            endpoints = sorted(self.endpoints,
+                               key=lambda e: (not e.healthy, e.latency))
+        return [endpoint.url for endpoint in endpoints]
+
+    def report_success(self, url, latency=None):
+        """Mark a replica as healthy and add a health check latency."""
+        with self._lock:
+            endpoint = self._endpoint(url)
+            if endpoint is None:
+                return
+            if not endpoint.healthy:
+                LOG.info('Keystone endpoint %s is healthy again.', url)
+            endpoint.healthy = True
+            endpoint.failures = 0
+            if latency is None:
+                return
+            if endpoint.latency:
+                endpoint.latency += self.alpha * (latency - endpoint.latency)
+            else:
+                endpoint.latency = latency
+
+    def report_failure(self, url):
+        with self._lock:
+            endpoint = self._endpoint(url)
+            if endpoint is None:
+                return
+            if endpoint.healthy:
+                LOG.warning('Keystone endpoint %s is unhealthy.', url)
+            endpoint.healthy = False
+            endpoint.failures += 1
+
+    def check(self):
+        for endpoint in list(self.endpoints):
+            start = time.monotonic()
+            try:
+                response = requests.get(
+                    endpoint.url, timeout=self.timeout,
+                    verify=(not settings.OPENSTACK_SSL_NO_VERIFY and
+                            (settings.OPENSTACK_SSL_CACERT or True)))
+            except requests.RequestException:
+                self.report_failure(endpoint.url)
+                continue
+            if response.status_code >= 500:
+                self.report_failure(endpoint.url)
+            else:
+                self.report_success(endpoint.url, time.monotonic() - start)
+
+    def _work(self):
+        while True:
+            try:
+                self.check()
+            except Exception:
+                LOG.exception('Keystone health check failed.')
+            time.sleep(self.interval)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._work, name='rba-keystone-health',
+                    daemon=True)
+                self._thread.start()
+
+    def stats(self):
+        with self._lock:
+            return {endpoint.url: {'healthy': endpoint.healthy,
+                                   'latency': endpoint.latency,
+                                   'failures': endpoint.failures}
+                    for endpoint in self.endpoints}
+
+
+def get_pool(auth_url):
+    """Return the pool of the replicas of an ``auth_url``, or None."""
+    replicas = getattr(settings, 'RBA_KEYSTONE_ENDPOINTS', {}).get(auth_url)
+    if not replicas:
+        return None
+    pool = _pools.get(auth_url)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(auth_url)
+            if pool is None:
+                pool = EndpointPool(
+                    replicas,
+                    **getattr(settings, 'RBA_KEYSTONE_HEALTH_CHECK', {}))
+                pool.start()
+                _pools[auth_url] = pool
+    return pool
+
+
+def candidates(auth_url):
+    """Return the URLs to try for a login, at most one retry by default.
+
+    The number of additional replicas tried after a connection error or
+    timeout is limited by ``RBA_KEYSTONE_FAILOVER_RETRIES``.
+    """
+    pool = get_pool(auth_url)
+    if pool is None:
+        return [auth_url], None
+    retries = getattr(settings, 'RBA_KEYSTONE_FAILOVER_RETRIES', 1)
+    return pool.ordered()[:retries + 1], pool
+
+
+def all_pools():
+    return dict(_pools)
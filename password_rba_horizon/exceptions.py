@@ -19,3 +19,7 @@ from openstack_auth import exceptions
 class KeystoneAdditionalStepsRequiredException(
         exceptions.KeystoneCredentialsException):
     """Additional authentications steps required."""
+
+
+class KeystoneRateLimitException(exceptions.KeystoneAuthException):
+    """Too many login attempts."""
@@ -0,0 +1,246 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import functools
+import ipaddress
+import logging
+import re
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from openstack_auth import utils
+
+from password_rba_horizon import ipindex
+from password_rba_horizon import metrics
+from password_rba_horizon import probes
+
+try:
+    from ua_parser import user_agent_parser
+except ImportError:
+    user_agent_parser = None
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_FEATURE_EXTRACTORS = [
+    'password_rba_horizon.features.IPExtractor',
+    'password_rba_horizon.features.RTTExtractor',
+    'password_rba_horizon.features.UserAgentExtractor',
+]
+
+_BROWSERS = [
+    ('Edge', re.compile(r'Edg(?:e|A|iOS)?/(\d+)')),
+    ('Opera', re.compile(r'OPR/(\d+)')),
+    ('Chrome', re.compile(r'(?:Chrome|CriOS)/(\d+)')),
+    ('Firefox', re.compile(r'(?:Firefox|FxiOS)/(\d+)')),
+    ('Safari', re.compile(r'Version/(\d+).*Safari/')),
+]
+_OPERATING_SYSTEMS = [
+    ('Android', re.compile(r'Android')),
+    ('iOS', re.compile(r'iPhone|iPad|iPod')),
+    ('Windows', re.compile(r'Windows')),
+    ('Mac OS X', re.compile(r'Mac OS X')),
+    ('Linux', re.compile(r'Linux')),
+]
+
+_extractors = None
+_extractors_lock = threading.Lock()
+
+
+def parse_user_agent(user_agent):
+    """Return the browser family, major version and OS of a User-Agent.
+
+    The ``ua-parser`` package is used if it is installed, otherwise the
+    most common browsers are recognized.
+    """
+    if user_agent_parser is not None:
+        parsed = user_agent_parser.Parse(user_agent)
+        return (parsed['user_agent']['family'],
+                parsed['user_agent']['major'] or '',
+                parsed['os']['family'])
+    family, version, os_family = 'Other', '', 'Other'
+    for name, pattern in _BROWSERS:
+        match = pattern.search(user_agent)
+        if match:
+            family, version = name, match.group(1)
+            break
+    for name, pattern in _OPERATING_SYSTEMS:
+        if pattern.search(user_agent):
+            os_family = name
+            break
+    return family, version, os_family
+
+
+def proxied_address(value):
+    """Return the client address of a ``SECURE_PROXY_ADDR_HEADER`` value.
+
+    The trusted proxy appends the address it received the request from to
+    a list like ``X-Forwarded-For``, whose other entries are set by the
+    client.
+    """
+    return value.split(',')[-1].strip()
+
+
+class FeatureContext(object):
+    """Values of a login request shared by all feature extractors.
+
+    Every value is computed at most once per request.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self._client_ip = None
+        self._rtt_stats = False
+
+    @property
+    def client_ip(self):
+        if self._client_ip is None:
+            self._client_ip = proxied_address(
+                utils.get_client_ip(self.request) or '')
+        return self._client_ip
+
+    @property
+    def rtt_stats(self):
+        """Statistics of the RTT measurement of the session, or None.
+
+        The result is consumed from the result store on first access. While
+        a measurement of the session is still in flight, it is awaited for
+        up to ``RBA_RTT_WAIT_TIMEOUT`` seconds. A measurement that finished
+        between the two lookups is picked up by a second read.
+        """
+        if self._rtt_stats is False:
+            session_key = self.request.session.session_key
+            stats = probes.result_store.consume(session_key)
+            timeout = getattr(settings, 'RBA_RTT_WAIT_TIMEOUT', 0.5)
+            if stats is None and session_key and timeout:
+                if session_key in probes.probe_store:
+                    with metrics.timed('rtt_wait'):
+                        stats = probes.result_store.wait(session_key,
+                                                         timeout)
+                else:
+                    stats = probes.result_store.consume(session_key)
+            self._rtt_stats = stats
+        return self._rtt_stats
+
+    @property
+    def user_agent(self):
+        return self.request.headers.get('User-Agent', '')
+
+
+class FeatureExtractor(object):
+    """Base class of the extractors listed in ``RBA_FEATURE_EXTRACTORS``.
+
+    Extractors are instantiated once per process and have to be thread-safe.
+    """
+
+    def extract(self, context):
+        """Return a dict of the features found in the request context."""
+        raise NotImplementedError
+
+
+class IPExtractor(FeatureExtractor):
+
+    def extract(self, context):
+        return {'ip': context.client_ip}
+
+
+class IPPrefixExtractor(FeatureExtractor):
+    """Network of the client IP, /24 for IPv4 and /48 for IPv6 by default."""
+
+    def __init__(self):
+        self.ipv4_prefix = getattr(settings, 'RBA_IPV4_PREFIX_LENGTH', 24)
+        self.ipv6_prefix = getattr(settings, 'RBA_IPV6_PREFIX_LENGTH', 48)
+
+    def extract(self, context):
+        try:
+            address = ipaddress.ip_address(context.client_ip)
+        except ValueError:
+            return {'ip_prefix': ''}
+        length = self.ipv4_prefix if address.version == 4 else self.ipv6_prefix
+        network = ipaddress.ip_network((address, length), strict=False)
+        return {'ip_prefix': str(network)}
+
+
+class IPEnrichmentExtractor(FeatureExtractor):
+    """ASN and country of the client IP from the index at
+    ``RBA_IP_INDEX_PATH``, built by ``tools/build_ip_index.py``.
+    """
+
+    def __init__(self):
+        path = getattr(settings, 'RBA_IP_INDEX_PATH', None)
+        if not path:
+            raise ImproperlyConfigured(
+                'IPEnrichmentExtractor requires RBA_IP_INDEX_PATH.')
+        self.index = ipindex.IPIndex(path)
+
+    def extract(self, context):
+        found = self.index.lookup(context.client_ip or '')
+        if found is None:
+            return {'asn': '', 'country': ''}
+        asn, country = found
+        return {'asn': str(asn) if asn else '', 'country': country}
+
+
+class UserAgentExtractor(FeatureExtractor):
+
+    def extract(self, context):
+        return {'ua': context.user_agent}
+
+
+class ParsedUserAgentExtractor(FeatureExtractor):
+    """Browser family, version and OS of the User-Agent.
+
+    The results are memoized in an LRU cache of ``RBA_UA_CACHE_SIZE``
+    entries, as few distinct User-Agents make up most logins.
+    """
+
+    def __init__(self):
+        self.parse = functools.lru_cache(
+            maxsize=getattr(settings, 'RBA_UA_CACHE_SIZE', 1024)
+        )(parse_user_agent)
+
+    def extract(self, context):
+        family, version, os_family = self.parse(context.user_agent)
+        return {'ua_family': family,
+                'ua_version': version,
+                'ua_os': os_family}
+
+
+class RTTExtractor(FeatureExtractor):
+
+    def extract(self, context):
+        stats = context.rtt_stats
+        return {'rtt': str(round(stats['min'])) if stats else ''}
+
+
+def get_extractors():
+    global _extractors
+    if _extractors is None:
+        with _extractors_lock:
+            if _extractors is None:
+                paths = getattr(settings, 'RBA_FEATURE_EXTRACTORS',
+                                DEFAULT_FEATURE_EXTRACTORS)
+                _extractors = [import_string(path)() for path in paths]
+    return _extractors
+
+
+def extract_features(context):
+    """Return the RBA features of the request of the given context."""
+    features = {}
+    for extractor in get_extractors():
+        features.update(extractor.extract(context))
+    return features
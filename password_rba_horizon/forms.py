@@ -15,6 +15,7 @@
 
 import copy
 import logging
+import time
 
 from django.conf import settings
 from django.contrib.auth import authenticate
@@ -28,7 +29,13 @@ from openstack_auth import forms as oa_forms
 from openstack_auth import utils
 from openstack_auth.forms import get_region_endpoint
 
+from password_rba_horizon import audit
+from password_rba_horizon import coalesce
 from password_rba_horizon import exceptions as exception
+from password_rba_horizon import features as rba_features
+from password_rba_horizon import metrics
+from password_rba_horizon import profiling
+from password_rba_horizon import ratelimit
 
 LOG = logging.getLogger(__name__)
 
@@ -58,9 +65,13 @@ class Login(oa_forms.Login):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['passcode'] = copy.deepcopy(self.base_fields['passcode'])
-        if self.request.method == 'GET':
+        # The RTT consumer requires a session key. Only a new session is
+        # written, the RTT itself is handed over through the result store.
+        if (self.request.method == 'GET' and
+                self.request.session.session_key is None):
             self.request.session['rtt'] = None
 
+    @profiling.profiled('login')
     @sensitive_variables()
     def clean(self):
         default_domain = settings.OPENSTACK_KEYSTONE_DEFAULT_DOMAIN
@@ -70,7 +81,8 @@ class Login(oa_forms.Login):
         domain = self.cleaned_data.get('domain', default_domain)
         region_id = self.cleaned_data.get('region')
         try:
-            region = get_region_endpoint(region_id)
+            with metrics.timed('region_endpoint'):
+                region = get_region_endpoint(region_id)
         except (ValueError, IndexError, TypeError):
             raise forms.ValidationError("Invalid region %r" % region_id)
         self.cleaned_data['region'] = region
@@ -79,43 +91,62 @@ class Login(oa_forms.Login):
             # Don't authenticate, just let the other validators handle it.
             return self.cleaned_data
 
+        context = rba_features.FeatureContext(self.request)
+        start = time.perf_counter()
+        outcome = 'error'
+        features = None
+        # A passcode that failed the field validation is asked for again
+        # without a new challenge of keystone.
+        passcode_invalid = passcode is None
         try:
-            features = None
-            if passcode is None:
+            if passcode_invalid:
                 raise exception.KeystoneAdditionalStepsRequiredException()
+            if (ratelimit.rate_limit_enabled() and
+                    not ratelimit.login_limiter.acquire(
+                        context.client_ip, '%s@%s' % (username, domain))):
+                metrics.LOGIN_ATTEMPTS.inc('rate_limited')
+                raise exception.KeystoneRateLimitException(
+                    _('Too many login attempts. Please try again later.'))
             if not passcode:
-                rtt = self.request.session.get('rtt')
-                features = {'ip': utils.get_client_ip(self.request),
-                            'rtt': rtt if rtt is not None else '',
-                            'ua': self.request.headers.get('User-Agent', '')}
-                LOG.debug(str(features))
+                features = rba_features.extract_features(context)
+                LOG.debug('RBA features: %s', features)
                 passcode = None
-            self.user_cache = authenticate(request=self.request,
-                                           auth_url=region,
-                                           username=username,
-                                           password=password,
-                                           user_domain_name=domain,
-                                           passcode=passcode,
-                                           features=features)
-
-            LOG.debug("forms self.user_cache" + str(self.user_cache))
+            session_key = self.request.session.session_key
+            coalesce_key = coalesce.login_key(
+                session_key or context.client_ip,
+                region, username, password, domain, passcode)
+            with metrics.timed('authenticate'):
+                self.user_cache = authenticate(request=self.request,
+                                               auth_url=region,
+                                               username=username,
+                                               password=password,
+                                               user_domain_name=domain,
+                                               passcode=passcode,
+                                               features=features,
+                                               coalesce_key=coalesce_key,
+                                               session_key=session_key)
+
+            outcome = 'success'
+            LOG.debug('forms self.user_cache %s', self.user_cache)
 
             LOG.info('Login successful for user "%(username)s" using domain '
                      '"%(domain)s", remote address %(remote_ip)s.',
                      {'username': username, 'domain': domain,
-                      'remote_ip': utils.get_client_ip(self.request)})
+                      'remote_ip': context.client_ip})
 
         except exceptions.KeystonePassExpiredException as exc:
+            outcome = 'expired'
             LOG.info('Login failed for user "%(username)s" using domain '
                      '"%(domain)s", remote address %(remote_ip)s: password'
                      ' expired.',
                      {'username': username, 'domain': domain,
-                      'remote_ip': utils.get_client_ip(self.request)})
+                      'remote_ip': context.client_ip})
             if utils.allow_expired_passowrd_change():
                 raise
             raise forms.ValidationError(exc)
 
         except exception.KeystoneAdditionalStepsRequiredException:
+            outcome = 'passcode_invalid' if passcode_invalid else 'challenged'
             self.show_passcode_field()
             self.add_error(None, 'For security reasons we would '
                             'like to verify your identity. This is '
@@ -128,12 +159,32 @@ class Login(oa_forms.Login):
             raise forms.ValidationError(msg)
 
         except exceptions.KeystoneAuthException as exc:
+            if isinstance(exc, exception.KeystoneRateLimitException):
+                outcome = 'rate_limited'
+            elif isinstance(exc, exceptions.KeystoneConnectionException):
+                outcome = 'connect_failure'
+            elif isinstance(exc, exceptions.KeystoneCredentialsException):
+                outcome = 'invalid'
             self.reset_fields()
             LOG.info('Login failed for user "%(username)s" using domain '
                      '"%(domain)s", remote address %(remote_ip)s.',
                      {'username': username, 'domain': domain,
-                      'remote_ip': utils.get_client_ip(self.request)})
+                      'remote_ip': context.client_ip})
             raise forms.ValidationError(exc)
+
+        finally:
+            if audit.audit_enabled():
+                audit.audit_log.record(
+                    user=username,
+                    domain=domain,
+                    ip=context.client_ip,
+                    ua=context.user_agent,
+                    rtt=features.get('rtt') if features else None,
+                    passcode=bool(passcode),
+                    outcome=outcome,
+                    challenged=outcome == 'challenged',
+                    duration_ms=round(
+                        (time.perf_counter() - start) * 1000, 1))
         return self.cleaned_data
 
     def show_passcode_field(self):
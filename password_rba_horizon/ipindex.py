@@ -0,0 +1,175 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Memory-mapped index of IP ranges to their ASN and country.
+
+The index file is built from a CSV file of ``prefix,asn,country`` rows by
+``tools/build_ip_index.py``. It holds, for IPv4 and IPv6 separately, the
+sorted and non-overlapping ranges as arrays of start addresses, end
+addresses, ASNs and two letter country codes. Nested prefixes are split,
+the most specific prefix wins. IPv6 ranges are indexed by the upper 64
+bits of the addresses, so prefixes longer than /64 are widened to /64.
+
+The file is mapped read-only, so all worker processes share one copy in
+the page cache. A lookup is a binary search over the mapped arrays.
+"""
+
+import array
+import bisect
+import csv
+import ipaddress
+import mmap
+import socket
+import struct
+import sys
+
+MAGIC = b'RBAIPX1' + (b'l' if sys.byteorder == 'little' else b'b')
+HEADER = struct.Struct('=8sII')
+
+
+def _pad(size):
+    return -size % 8
+
+
+def _flatten(ranges):
+    """Split nested ``(start, end, value)`` ranges into disjoint ones."""
+    ranges.sort(key=lambda r: (r[0], -r[1]))
+    flat = []
+    stack = []
+    position = 0
+
+    def close(upto):
+        nonlocal position
+        while stack and stack[-1][1] < upto:
+            _, end, value = stack.pop()
+            if position <= end:
+                flat.append((position, end, value))
+                position = end + 1
+
+    for start, end, value in ranges:
+        close(start)
+        if stack and position < start:
+            flat.append((position, start - 1, stack[-1][2]))
+        stack.append((start, end, value))
+        position = start
+    close(float('inf'))
+    return flat
+
+
+def _asn(value):
+    value = value.strip().upper()
+    if value.startswith('AS'):
+        value = value[2:]
+    return int(value) if value else 0
+
+
+def read_csv(f):
+    """Return the IPv4 and IPv6 ranges of ``prefix,asn,country`` rows.
+
+    Rows whose prefix does not parse, e.g. a header, are skipped.
+    """
+    v4, v6 = [], []
+    for row in csv.reader(f):
+        if len(row) < 3:
+            continue
+        try:
+            network = ipaddress.ip_network(row[0].strip(), strict=False)
+            asn = _asn(row[1])
+        except ValueError:
+            continue
+        country = row[2].strip().upper().encode('ascii')[:2].ljust(2, b'\0')
+        start = int(network.network_address)
+        end = int(network.broadcast_address)
+        if network.version == 4:
+            v4.append((start, end, (asn, country)))
+        else:
+            v6.append((start >> 64, end >> 64, (asn, country)))
+    return _flatten(v4), _flatten(v6)
+
+
+def write_index(path, v4, v6):
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(v4), len(v6)))
+        for ranges, typecode in ((v4, 'I'), (v6, 'Q')):
+            f.write(array.array(typecode, (r[0] for r in ranges)).tobytes())
+            f.write(array.array(typecode, (r[1] for r in ranges)).tobytes())
+            f.write(array.array('I', (r[2][0] for r in ranges)).tobytes())
+            countries = b''.join(r[2][1] for r in ranges)
+            f.write(countries + b'\0' * _pad(f.tell() + len(countries)))
+
+
+def build(csv_path, index_path):
+    """Build the index file ``index_path`` from a CSV file."""
+    with open(csv_path, newline='') as f:
+        v4, v6 = read_csv(f)
+    write_index(index_path, v4, v6)
+    return len(v4), len(v6)
+
+
+class IPIndex(object):
+    """Read-only view of an index file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        magic, v4_count, v6_count = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError('%s is not an IP index of this platform' % path)
+        offset = HEADER.size
+        self.v4, offset = self._section(view, offset, v4_count, 'I', 4)
+        self.v6, offset = self._section(view, offset, v6_count, 'Q', 8)
+
+    @staticmethod
+    def _section(view, offset, count, typecode, size):
+        arrays = []
+        for width, code in ((size, typecode), (size, typecode), (4, 'I')):
+            arrays.append(view[offset:offset + count * width].cast(code))
+            offset += count * width
+        arrays.append(view[offset:offset + count * 2])
+        offset += count * 2
+        return arrays, offset + _pad(offset)
+
+    @staticmethod
+    def _find(section, value):
+        starts, ends, asns, countries = section
+        index = bisect.bisect_right(starts, value) - 1
+        if index < 0 or value > ends[index]:
+            return None
+        return asns[index], bytes(countries[index * 2:index * 2 + 2])
+
+    def lookup(self, address):
+        """Return the ASN and country code of an address, or None.
+
+        Unknown ASNs are 0 and unknown countries an empty string.
+        """
+        try:
+            if ':' in address:
+                value = int.from_bytes(
+                    socket.inet_pton(socket.AF_INET6, address)[:8], 'big')
+                found = self._find(self.v6, value)
+            else:
+                value = int.from_bytes(
+                    socket.inet_pton(socket.AF_INET, address), 'big')
+                found = self._find(self.v4, value)
+        except (OSError, ValueError):
+            return None
+        if found is None:
+            return None
+        asn, country = found
+        return asn, country.rstrip(b'\0').decode('ascii')
+
+    def __len__(self):
+        return len(self.v4[0]) + len(self.v6[0])
@@ -0,0 +1,151 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import http.cookiejar
+import logging
+import threading
+import time
+import weakref
+
+import requests
+
+from django.conf import settings
+from keystoneauth1 import session as ks_session
+
+from openstack_auth import utils
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_KEYSTONE_SESSION = {
+    'ENABLED': False,
+    'OPTIONS': {},
+}
+
+_session = None
+_session_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+class DiscoveryCache(object):
+    """Thread-safe discovery cache with expiring entries.
+
+    keystoneauth stores the version discovery document of every ``auth_url``
+    in the cache of the session. The entries expire after ``ttl`` seconds,
+    so changes of the Keystone deployment are picked up eventually.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, default=None):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return default
+            if entry[1] <= time.monotonic():
+                del self._entries[url]
+                return default
+            return entry[0]
+
+    def __setitem__(self, url, disc):
+        with self._lock:
+            entry = self._entries.get(url)
+            # keystoneauth stores cache hits again, which must not extend
+            # the lifetime of the entry.
+            if entry is not None and entry[0] is disc:
+                return
+            self._entries[url] = (disc, time.monotonic() + self.ttl)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _verify():
+    if settings.OPENSTACK_SSL_NO_VERIFY:
+        return False
+    return settings.OPENSTACK_SSL_CACERT or True
+
+
+def _options():
+    config = getattr(settings, 'RBA_KEYSTONE_SESSION',
+                     DEFAULT_KEYSTONE_SESSION)
+    return config.get('OPTIONS', {})
+
+
+def create_session(pool_connections=10, pool_maxsize=10, discovery_ttl=300,
+                   timeout=None):
+    """Create a keystoneauth session that keeps its connections alive.
+
+    The connections to Keystone are pooled by a requests session with
+    TCP keep-alive. Cookies are never stored, as the session is shared by
+    the logins of all users.
+    """
+    requests_session = requests.Session()
+    requests_session.cookies.set_policy(
+        http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    for scheme in ('https://', 'http://'):
+        requests_session.mount(scheme, ks_session.TCPKeepAliveAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize))
+
+    return ks_session.Session(session=requests_session,
+                              verify=_verify(),
+                              timeout=timeout,
+                              discovery_cache=DiscoveryCache(discovery_ttl))
+
+
+def get_session():
+    """Return the keystoneauth session used for the authentication.
+
+    With ``RBA_KEYSTONE_SESSION`` enabled, one session is shared by all
+    threads of the process. Otherwise a new session is created per call.
+    """
+    global _session
+    config = getattr(settings, 'RBA_KEYSTONE_SESSION',
+                     DEFAULT_KEYSTONE_SESSION)
+    if not config.get('ENABLED', False):
+        return utils.get_session()
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session(**_options())
+    return _session
+
+
+def get_async_client():
+    """Return the ``httpx`` client of the running event loop.
+
+    The client keeps up to ``pool_maxsize`` connections to keystone alive
+    and is shared by all coroutines of the loop.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        options = _options()
+        pool_maxsize = options.get('pool_maxsize', 10)
+        client = httpx.AsyncClient(
+            verify=_verify(),
+            timeout=options.get('timeout'),
+            limits=httpx.Limits(max_connections=pool_maxsize,
+                                max_keepalive_connections=pool_maxsize))
+        _async_clients[loop] = client
+    return client
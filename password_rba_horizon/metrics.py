@@ -0,0 +1,235 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process metrics of the login and RTT hot paths.
+
+The metrics are kept per process and rendered in the Prometheus text
+exposition format by ``exposition()``.
+"""
+
+import bisect
+import contextlib
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+REGISTRY = []
+
+# Callables receiving the stage and the seconds of every ``timed`` stage.
+STAGE_HOOKS = []
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ('%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                          .replace('"', '\\"'))
+             for name, value in zip(names, values))
+    return '{%s}' % ','.join(pairs)
+
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def samples(self):
+        """Return the exposition lines without the HELP and TYPE header."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation),
+                 '# TYPE %s %s' % (self.name, self.kind)]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """Counter incremented explicitly or read from ``callback``.
+
+    The callback returns a value, or a dict of label tuples to values.
+    """
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        if self.callback is not None:
+            try:
+                values = self.callback()
+            except Exception:
+                return []
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return ['%s%s %s' % (self.name, _labels(self.labelnames, labels),
+                             value)
+                for labels, value in sorted(values.items())]
+
+
+class Gauge(Counter):
+    """Gauge set explicitly or read from ``callback`` on exposition."""
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, *args, buckets=DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(
+                labels, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[labels] = (counts, total + value)
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, (list(counts), total))
+                            for labels, (counts, total)
+                            in self._values.items())
+        lines = []
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('%s_bucket%s %d' % (
+                    self.name,
+                    _labels(self.labelnames + ('le',), labels + (bound,)),
+                    cumulative))
+            lines.append('%s_sum%s %s' % (
+                self.name, _labels(self.labelnames, labels), total))
+            lines.append('%s_count%s %d' % (
+                self.name, _labels(self.labelnames, labels), cumulative))
+        return lines
+
+
+def exposition():
+    """Render all registered metrics in the Prometheus text format."""
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+def _probe_entries():
+    from password_rba_horizon import probes
+    return len(probes.probe_store)
+
+
+def _outbox_stats():
+    from password_rba_horizon import outbox
+    if not outbox.outbox_enabled():
+        return {}
+    stats = outbox.passcode_outbox.stats()
+    return {(key,): value for key, value in stats.items()}
+
+
+def _rate_limit_stats():
+    from password_rba_horizon import ratelimit
+    if not ratelimit.rate_limit_enabled():
+        return {}
+    return ratelimit.login_limiter.stats()
+
+
+def _circuit_states():
+    from password_rba_horizon import circuit
+    return circuit.states()
+
+
+STAGE_SECONDS = Histogram(
+    'rba_stage_seconds',
+    'Duration of the stages of a login attempt.',
+    labelnames=('stage',))
+LOGIN_ATTEMPTS = Counter(
+    'rba_login_attempts_total',
+    'Login attempts by outcome.',
+    labelnames=('outcome',))
+PASSCODE_RESENDS = Counter(
+    'rba_passcode_resends_total',
+    'Passcode re-send requests by result.',
+    labelnames=('result',))
+RTT_SECONDS = Histogram(
+    'rba_rtt_collection_seconds',
+    'Duration of the RTT measurement of a socket.')
+RTT_OPEN_SOCKETS = Gauge(
+    'rba_rtt_open_sockets',
+    'Open RTT WebSocket connections.')
+RTT_REJECTED_SOCKETS = Counter(
+    'rba_rtt_limited_sockets_total',
+    'RTT WebSocket connections refused or closed by a limit.',
+    labelnames=('reason',))
+RTT_PROBE_ENTRIES = Gauge(
+    'rba_rtt_probe_entries',
+    'Sessions with in-flight RTT probes in the local probe store.',
+    callback=_probe_entries)
+OUTBOX = Gauge(
+    'rba_passcode_outbox',
+    'Passcode outbox queue depth, message counts and latencies in seconds.',
+    labelnames=('stat',),
+    callback=_outbox_stats)
+RATE_LIMIT = Counter(
+    'rba_rate_limit_attempts_total',
+    'Login attempts seen by the rate limiter per bucket and result.',
+    labelnames=('bucket', 'result'),
+    callback=_rate_limit_stats)
+CIRCUIT_STATE = Gauge(
+    'rba_circuit_breaker_state',
+    'State of the keystone circuit breakers, 0 closed, 1 half-open, '
+    '2 open.',
+    labelnames=('endpoint',),
+    callback=_circuit_states)
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """Context manager observing the duration of a login stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_SECONDS.observe(seconds, stage)
+        for hook in STAGE_HOOKS:
+            hook(stage, seconds)
@@ -0,0 +1,71 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from importlib import import_module
+
+from asgiref.sync import sync_to_async
+from channels.security.websocket import AllowedHostsOriginValidator
+from django.conf import settings
+from django.http.cookie import parse_cookie
+from django.utils.functional import SimpleLazyObject
+
+
+class SessionKeyMiddleware(object):
+    """Provide ``scope['session']`` without loading it or the user.
+
+    Unlike ``channels.auth.AuthMiddlewareStack`` no user is resolved and
+    the session is neither loaded nor saved. The session backend is asked
+    once whether the key of the session cookie exists, and the session
+    store is created on first access of ``scope['session']``. It only
+    reads the session backend when its data is accessed. Without a cookie
+    of an existing session the session is an empty session without a key.
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.session_store = None
+
+    def _store(self, session_key):
+        if self.session_store is None:
+            self.session_store = import_module(
+                settings.SESSION_ENGINE).SessionStore
+        return self.session_store(session_key)
+
+    def _existing_key(self, session_key):
+        store = self._store(session_key)
+        # The store drops keys that are malformed.
+        if store.session_key is None or not store.exists(store.session_key):
+            return None
+        return store.session_key
+
+    async def __call__(self, scope, receive, send):
+        session_key = None
+        for name, value in scope.get('headers', ()):
+            if name == b'cookie':
+                cookies = parse_cookie(value.decode('latin1'))
+                session_key = cookies.get(settings.SESSION_COOKIE_NAME)
+                break
+        if session_key is not None:
+            session_key = await sync_to_async(
+                self._existing_key, thread_sensitive=False)(session_key)
+        scope = dict(scope,
+                     session=SimpleLazyObject(
+                         lambda: self._store(session_key)))
+        return await self.inner(scope, receive, send)
+
+
+def RTTMiddlewareStack(inner):
+    """Origin validation and session key middleware of the RTT route."""
+    return AllowedHostsOriginValidator(SessionKeyMiddleware(inner))
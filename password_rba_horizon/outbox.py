@@ -0,0 +1,150 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import BadHeaderError
+from django.core.mail import EmailMessage
+from django.core.mail import get_connection
+from django.utils.functional import SimpleLazyObject
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_OUTBOX = {
+    'ENABLED': False,
+    'OPTIONS': {},
+}
+
+
+class PasscodeOutbox(object):
+    """Queue of passcode emails sent by a pool of background workers.
+
+    Every worker keeps its own long-lived connection of the configured
+    ``EMAIL_BACKEND``, so consecutive messages reuse the SMTP session.
+    Failed sends are retried ``retries`` times with an exponential backoff
+    starting at ``backoff`` seconds, reconnecting before each retry.
+    """
+
+    def __init__(self, workers=2, max_queue=1000, retries=3, backoff=0.5):
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._work,
+                    name='rba-outbox-%d' % len(self._threads),
+                    daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, subject, message, from_email, recipient_list):
+        """Queue a message without waiting for the delivery.
+
+        :returns: False if the queue is full.
+        """
+        self.start()
+        try:
+            self._queue.put_nowait((time.monotonic(), subject, message,
+                                    from_email, recipient_list))
+        except queue.Full:
+            LOG.warning('Passcode outbox is full, %d messages queued.',
+                        self._queue.qsize())
+            return False
+        return True
+
+    def stats(self):
+        with self._stats_lock:
+            return {'queue_depth': self._queue.qsize(),
+                    'sent': self.sent,
+                    'failed': self.failed,
+                    'retried': self.retried,
+                    'latency_avg': (self.latency_sum / self.sent
+                                    if self.sent else 0.0),
+                    'latency_max': self.latency_max}
+
+    def _work(self):
+        connection = get_connection(fail_silently=False)
+        while True:
+            item = self._queue.get()
+            try:
+                self._deliver(connection, *item)
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, connection, enqueued, subject, message, from_email,
+                 recipient_list):
+        email = EmailMessage(subject, message, from_email, recipient_list,
+                             connection=connection)
+        for attempt in range(self.retries + 1):
+            try:
+                # Opening an already open connection is a no-op, an opened
+                # connection is not closed by the backend after sending.
+                connection.open()
+                email.send()
+            except BadHeaderError as exc:
+                LOG.warning('Dropping passcode email: %s', exc)
+                with self._stats_lock:
+                    self.failed += 1
+                return
+            except Exception as exc:
+                LOG.warning('Sending passcode email failed (attempt %d): %s',
+                            attempt + 1, exc)
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+                if attempt == self.retries:
+                    with self._stats_lock:
+                        self.failed += 1
+                    return
+                with self._stats_lock:
+                    self.retried += 1
+                time.sleep(self.backoff * 2 ** attempt)
+            else:
+                latency = time.monotonic() - enqueued
+                with self._stats_lock:
+                    self.sent += 1
+                    self.latency_sum += latency
+                    self.latency_max = max(self.latency_max, latency)
+                return
+
+
+def outbox_enabled():
+    config = getattr(settings, 'RBA_PASSCODE_OUTBOX', DEFAULT_OUTBOX)
+    return config.get('ENABLED', False)
+
+
+def create_outbox():
+    config = getattr(settings, 'RBA_PASSCODE_OUTBOX', DEFAULT_OUTBOX)
+    return PasscodeOutbox(**config.get('OPTIONS', {}))
+
+
+passcode_outbox = SimpleLazyObject(create_outbox)
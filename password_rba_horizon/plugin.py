@@ -13,23 +13,35 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextvars
+import functools
 import logging
 import re
 
+from asgiref.sync import async_to_sync
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.core.mail import send_mail
 from django.core.mail import BadHeaderError
 from django.utils.translation import gettext_lazy as _
 
+from keystoneauth1 import access
 from keystoneauth1 import exceptions as keystone_exceptions
 from keystoneauth1.extras import rba as v3_rba
 from keystoneauth1.identity import v3
 
 from openstack_auth.plugin import base
 from openstack_auth import exceptions
-from openstack_auth import utils
 
+from password_rba_horizon import challenges
+from password_rba_horizon import circuit
+from password_rba_horizon import coalesce
+from password_rba_horizon import endpoints
 from password_rba_horizon import exceptions as exception
+from password_rba_horizon import keystone
+from password_rba_horizon import metrics
+from password_rba_horizon import profiling
+from password_rba_horizon import outbox
 
 from oslo_serialization import jsonutils
 
@@ -37,6 +49,17 @@ LOG = logging.getLogger(__name__)
 
 __all__ = ['RBAPasswordPlugin']
 
+PASSWORD_EXPIRED_PATTERN = re.compile(
+    r"The password is expired and needs to be changed for user: ([^.]*)[.].*")
+ADDITIONAL_STEPS_PATTERN = re.compile(
+    r"Additional authentications steps required\..*")
+
+# Set by the asynchronous login view, whose blocking part waits in a thread
+# for the event loop of the worker. The request to keystone is then sent
+# from that loop instead of the thread.
+keystone_on_loop = contextvars.ContextVar('rba_keystone_on_loop',
+                                          default=False)
+
 
 class RBAPasswordPlugin(base.BasePlugin):
     """Authenticate against keystone with risk-based authentication
@@ -57,63 +80,248 @@ class RBAPasswordPlugin(base.BasePlugin):
     """
     def send_passcode_email(self, email_receipient_address, passcode):
         if passcode and email_receipient_address:
-            try:
-                subject = 'Your personal security code'
-                content = """Dear user,\nsomeone just tried to sign in to your account.\nIf you were prompted for a security code, please enter the following to complete your sign-in: """ + passcode + """\nIf you were not prompted, please change your password immediately in the profile settings.""" 
-                LOG.debug(subject)
-                LOG.debug(content)
-                LOG.debug(settings.EMAIL_HOST_USER)
-                if settings.EMAIL_HOST_USER is not None:
-                    send_mail(subject,
-                              content,
-                              settings.EMAIL_HOST_USER,
-                              [email_receipient_address],
-                              fail_silently=False,
-                              )
-            except BadHeaderError:
-                pass
+            with metrics.timed('passcode_email'):
+                try:
+                    subject = 'Your personal security code'
+                    content = """Dear user,\nsomeone just tried to sign in to your account.\nIf you were prompted for a security code, please enter the following to complete your sign-in: """ + passcode + """\nIf you were not prompted, please change your password immediately in the profile settings.""" 
+                    LOG.debug(subject)
+                    LOG.debug(content)
+                    LOG.debug(settings.EMAIL_HOST_USER)
+                    if settings.EMAIL_HOST_USER is not None:
+                        if (outbox.outbox_enabled() and
+                                outbox.passcode_outbox.enqueue(
+                                    subject,
+                                    content,
+                                    settings.EMAIL_HOST_USER,
+                                    [email_receipient_address])):
+                            return
+                        send_mail(subject,
+                                  content,
+                                  settings.EMAIL_HOST_USER,
+                                  [email_receipient_address],
+                                  fail_silently=False,
+                                  )
+                except BadHeaderError:
+                    pass
 
+    @profiling.profiled('get_access_info')
     def get_access_info(self, keystone_auth):
         """Get the access info from an unscoped auth
 
         This function provides the base functionality that the
         plugins will use to authenticate and get the access info object.
 
+        Identical login attempts that are in flight at the same time are
+        coalesced into one request to keystone, unless
+        ``RBA_COALESCE_LOGINS`` is disabled. Within the asynchronous login
+        view the request is awaited on the event loop by
+        ``aget_access_info``.
+
         :param keystone_auth: keystoneauth1 identity plugin
         :raises: exceptions.KeystoneAuthException on auth failure
         :returns: keystoneclient.access.AccessInfo
         """
-        session = utils.get_session()
+        if keystone.httpx is not None and keystone_on_loop.get():
+            return async_to_sync(self.aget_access_info)(keystone_auth)
+        coalesce_key = getattr(keystone_auth, 'rba_coalesce_key', None)
+        if (coalesce_key is None or
+                not getattr(settings, 'RBA_COALESCE_LOGINS', True)):
+            return self._get_access_info(keystone_auth)
+        auth_ref, auth_url = coalesce.inflight_logins.do(
+            coalesce_key,
+            functools.partial(self._shared_access_info, keystone_auth),
+            timeout=getattr(settings, 'RBA_COALESCE_TIMEOUT', 30))
+        # Coalesced attempts adopt the token and endpoint of the shared
+        # login, so openstack_auth does not authenticate their plugin again.
+        keystone_auth.auth_url = auth_url
+        keystone_auth.auth_ref = auth_ref
+        return auth_ref
+
+    def _shared_access_info(self, keystone_auth):
+        return self._get_access_info(keystone_auth), keystone_auth.auth_url
+
+    def _get_access_info(self, keystone_auth):
+        session = keystone.get_session()
+        urls, pool = endpoints.candidates(keystone_auth.auth_url)
+
+        try:
+            for index, url in enumerate(urls):
+                keystone_auth.auth_url = url
+                try:
+                    with circuit.guard(url), metrics.timed('keystone'):
+                        unscoped_auth_ref = keystone_auth.get_access(session)
+                except keystone_exceptions.ConnectionError as exc:
+                    if (pool is not None and
+                            not isinstance(exc, circuit.CircuitOpenError)):
+                        pool.report_failure(url)
+                    if index == len(urls) - 1:
+                        raise
+                    LOG.warning('Retrying login on another keystone '
+                                'endpoint: %s', exc)
+                else:
+                    if pool is not None:
+                        pool.report_success(url)
+                    break
+        except (keystone_exceptions.ClientException,
+                keystone_exceptions.AuthorizationFailure) as exc:
+            self._raise_auth_error(keystone_auth, exc)
+        metrics.LOGIN_ATTEMPTS.inc('success')
+        challenges.forget(getattr(keystone_auth, 'rba_session_key', None))
+        return unscoped_auth_ref
+
+    @profiling.profiled('get_access_info')
+    async def aget_access_info(self, keystone_auth):
+        """Awaitable counterpart of ``get_access_info``.
+
+        Sends the same password and rba token request to keystone with the
+        non-blocking ``httpx`` client and raises the same exceptions. Falls
+        back to running ``get_access_info`` in a thread if ``httpx`` is not
+        installed.
+
+        Login attempts are coalesced like in ``get_access_info``, with the
+        attempts of both functions sharing one request to keystone.
+
+        :param keystone_auth: keystoneauth1 v3 identity plugin
+        :raises: exceptions.KeystoneAuthException on auth failure
+        :returns: keystoneclient.access.AccessInfo
+        """
+        if keystone.httpx is None:
+            return await sync_to_async(self.get_access_info,
+                                       thread_sensitive=False)(keystone_auth)
+        coalesce_key = getattr(keystone_auth, 'rba_coalesce_key', None)
+        if (coalesce_key is None or
+                not getattr(settings, 'RBA_COALESCE_LOGINS', True)):
+            auth_ref = await self._aget_access_info(keystone_auth)
+        else:
+            auth_ref, auth_url = await coalesce.inflight_logins.ado(
+                coalesce_key,
+                functools.partial(self._ashared_access_info, keystone_auth),
+                timeout=getattr(settings, 'RBA_COALESCE_TIMEOUT', 30))
+            keystone_auth.auth_url = auth_url
+        keystone_auth.auth_ref = auth_ref
+        return auth_ref
+
+    async def _ashared_access_info(self, keystone_auth):
+        auth_ref = await self._aget_access_info(keystone_auth)
+        return auth_ref, keystone_auth.auth_url
+
+    async def _aget_access_info(self, keystone_auth):
+        raise_auth_error = sync_to_async(self._raise_auth_error,
+                                         thread_sensitive=False)
+        session = keystone.get_session()
+        urls, pool = endpoints.candidates(keystone_auth.auth_url)
+        try:
+            for index, auth_url in enumerate(urls):
+                keystone_auth.auth_url = auth_url
+                url, body, headers = self._token_request(keystone_auth,
+                                                         session)
+                try:
+                    with circuit.guard(auth_url), metrics.timed('keystone'):
+                        resp = await self._apost(url, body, headers)
+                        if resp.status_code >= 500:
+                            raise keystone_exceptions.from_response(
+                                resp, 'POST', url)
+                except keystone_exceptions.ConnectionError as exc:
+                    if (pool is not None and
+                            not isinstance(exc, circuit.CircuitOpenError)):
+                        pool.report_failure(auth_url)
+                    if index == len(urls) - 1:
+                        raise
+                    LOG.warning('Retrying login on another keystone '
+                                'endpoint: %s', exc)
+                else:
+                    if pool is not None:
+                        pool.report_success(auth_url)
+                    break
+            if resp.status_code >= 400:
+                raise keystone_exceptions.from_response(resp, 'POST', url)
+            try:
+                data = resp.json()
+            except ValueError:
+                raise keystone_exceptions.InvalidResponse(response=resp)
+            if 'token' not in data:
+                raise keystone_exceptions.InvalidResponse(response=resp)
+        except (keystone_exceptions.ClientException,
+                keystone_exceptions.AuthorizationFailure) as exc:
+            await raise_auth_error(keystone_auth, exc)
+        metrics.LOGIN_ATTEMPTS.inc('success')
+        await sync_to_async(challenges.forget, thread_sensitive=False)(
+            getattr(keystone_auth, 'rba_session_key', None))
+        return access.AccessInfoV3(auth_token=resp.headers['X-Subject-Token'],
+                                   body=data)
 
+    async def _apost(self, url, body, headers):
         try:
-            unscoped_auth_ref = keystone_auth.get_access(session)
-        except keystone_exceptions.ConnectFailure as exc:
+            return await keystone.get_async_client().post(
+                url, json=body, headers=headers)
+        except keystone.httpx.TimeoutException as exc:
+            raise keystone_exceptions.ConnectTimeout(str(exc))
+        except keystone.httpx.TransportError as exc:
+            raise keystone_exceptions.ConnectFailure(str(exc))
+
+    def _token_request(self, keystone_auth, session):
+        """Return the URL, body and headers of an unscoped token request.
+
+        Mirrors the request that ``v3.Auth`` sends on ``get_access``.
+        """
+        headers = {'Accept': 'application/json'}
+        identity = {}
+        request_kwargs = {}
+        for method in keystone_auth.auth_methods:
+            name, auth_data = method.get_auth_data(
+                session, keystone_auth, headers,
+                request_kwargs=request_kwargs)
+            if name:
+                identity.setdefault('methods', []).append(name)
+                identity[name] = auth_data
+        body = {'auth': {'identity': identity, 'scope': 'unscoped'}}
+        auth_url = keystone_auth.auth_url.rstrip('/')
+        if not auth_url.endswith('v3'):
+            auth_url += '/v3'
+        url = auth_url + '/auth/tokens'
+        if not keystone_auth.include_catalog:
+            url += '?nocatalog'
+        return url, body, headers
+
+    def _raise_auth_error(self, keystone_auth, exc):
+        """Raise the openstack_auth exception of a keystoneauth error.
+
+        A challenge of keystone additionally sends the passcode email.
+        """
+        if isinstance(exc, keystone_exceptions.ConnectionError):
+            metrics.LOGIN_ATTEMPTS.inc('connect_failure')
             LOG.error(str(exc))
             msg = _('Unable to establish connection to keystone endpoint.')
             raise exceptions.KeystoneConnectionException(msg)
-        except (keystone_exceptions.Unauthorized,
-                keystone_exceptions.Forbidden,
-                keystone_exceptions.NotFound) as exc:
+        if isinstance(exc, (keystone_exceptions.Unauthorized,
+                            keystone_exceptions.Forbidden,
+                            keystone_exceptions.NotFound)):
             msg = str(exc)
             LOG.debug(msg)
 
-            match = re.match(r"The password is expired and needs to be changed"
-                             r" for user: ([^.]*)[.].*", msg)
-            if match:
+            with metrics.timed('challenge_parse'):
+                expired = PASSWORD_EXPIRED_PATTERN.match(msg)
+                error = None
+                if not expired and ADDITIONAL_STEPS_PATTERN.match(msg):
+                    error = jsonutils.loads(exc.response.content)['error']
+
+            if expired:
+                metrics.LOGIN_ATTEMPTS.inc('expired')
                 exc = exceptions.KeystonePassExpiredException(
                     _('Password expired.'))
-                exc.user_id = match.group(1)
+                exc.user_id = expired.group(1)
                 raise exc
 
-            match = re.match(
-                r"Additional authentications steps required\..*", msg)
-            if match:
-                error = jsonutils.loads(exc.response._content)['error']
+            if error is not None:
+                metrics.LOGIN_ATTEMPTS.inc('challenged')
                 try:
                     response_identity = error['identity']
                     response_rba = response_identity['rba']
                     email = response_rba['contact']
                     passcode = response_rba['passcode']
+                    challenges.remember(
+                        getattr(keystone_auth, 'rba_session_key', None),
+                        email, passcode)
                     self.send_passcode_email(email, passcode)
                 except KeyError as e:
                     LOG.debug(e)
@@ -121,16 +329,15 @@ class RBAPasswordPlugin(base.BasePlugin):
                 exc = exception.KeystoneAdditionalStepsRequiredException(
                     _('Additional authentications steps required.'))
                 raise exc
+            metrics.LOGIN_ATTEMPTS.inc('invalid')
             msg = _('Invalid credentials.')
             raise exceptions.KeystoneCredentialsException(msg)
 
-        except (keystone_exceptions.ClientException,
-                keystone_exceptions.AuthorizationFailure) as exc:
-            msg = _("An error occurred authenticating. "
-                    "Please try again later.")
-            LOG.debug(str(exc))
-            raise exceptions.KeystoneAuthException(msg)
-        return unscoped_auth_ref
+        msg = _("An error occurred authenticating. "
+                "Please try again later.")
+        metrics.LOGIN_ATTEMPTS.inc('error')
+        LOG.debug(str(exc))
+        raise exceptions.KeystoneAuthException(msg)
 
     def get_plugin(self, auth_url=None,
                    username=None,
@@ -160,5 +367,7 @@ class RBAPasswordPlugin(base.BasePlugin):
                        auth_methods=[pw_method, rba_method],
                        unscoped=True,
                        )
+        auth.rba_coalesce_key = kwargs.get('coalesce_key', None)
+        auth.rba_session_key = kwargs.get('session_key', None)
 
-        return auth
\ No newline at end of file
+        return auth
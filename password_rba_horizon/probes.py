@@ -0,0 +1,303 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_PROBE_STORE = {
+    'BACKEND': 'password_rba_horizon.probes.LocMemProbeStore',
+    'OPTIONS': {},
+}
+
+
+class BaseProbeStore(object):
+    """State of the in-flight Round-Trip-Time probes per session.
+
+    A record consists of the sent tokens with their start times and the
+    list of measured round trips. Records and tokens expire after ``ttl``
+    seconds, so clients that never echo a token do not leave state behind.
+
+    ``clock`` is the time source used for the start and end times of a
+    probe. It has to be comparable across every process sharing the store.
+    ``blocking`` tells whether the operations wait for I/O, asynchronous
+    consumers then run them in a thread.
+    """
+    clock = staticmethod(time.perf_counter)
+    blocking = False
+
+    def __init__(self, ttl=30, max_tokens=16, **kwargs):
+        self.ttl = ttl
+        self.max_tokens = max_tokens
+
+    def open(self, session_key):
+        raise NotImplementedError
+
+    def add(self, session_key, token, start_time):
+        raise NotImplementedError
+
+    def pop(self, session_key, token):
+        """Remove a token and return its start time.
+
+        :raises: KeyError if the token is unknown or expired.
+        """
+        raise NotImplementedError
+
+    def append_rtt(self, session_key, rtt):
+        """Append a measured round trip and return all of the session."""
+        raise NotImplementedError
+
+    def discard(self, session_key):
+        """Remove the record and return the measured round trips."""
+        raise NotImplementedError
+
+    def __contains__(self, session_key):
+        """Return whether a measurement of the session is in flight."""
+        return False
+
+    def __len__(self):
+        return 0
+
+
+class LocMemProbeStore(BaseProbeStore):
+    """Bounded in-process LRU store for single worker deployments.
+
+    At most ``max_entries`` sessions are kept. The least recently used
+    record is evicted first once the bound is reached.
+    """
+
+    def __init__(self, max_entries=10000, **kwargs):
+        super().__init__(**kwargs)
+        self.max_entries = max_entries
+        self._records = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._records:
+            session_key, record = next(iter(self._records.items()))
+            if record['expires'] > now:
+                break
+            del self._records[session_key]
+
+    def _record(self, session_key):
+        now = self.clock()
+        self._expire(now)
+        record = self._records.get(session_key)
+        if record is None:
+            raise KeyError(session_key)
+        record['expires'] = now + self.ttl
+        self._records.move_to_end(session_key)
+        return record
+
+    def open(self, session_key):
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            record = self._records.setdefault(
+                session_key, {'tokens': {}, 'rtts': []})
+            record['expires'] = now + self.ttl
+            self._records.move_to_end(session_key)
+            while len(self._records) > self.max_entries:
+                self._records.popitem(last=False)
+
+    def add(self, session_key, token, start_time):
+        with self._lock:
+            tokens = self._record(session_key)['tokens']
+            tokens.setdefault(token, start_time)
+            while len(tokens) > self.max_tokens:
+                del tokens[next(iter(tokens))]
+
+    def pop(self, session_key, token):
+        with self._lock:
+            start_time = self._record(session_key)['tokens'].pop(token)
+        if self.clock() - start_time > self.ttl:
+            raise KeyError(token)
+        return start_time
+
+    def append_rtt(self, session_key, rtt):
+        with self._lock:
+            rtts = self._record(session_key)['rtts']
+            rtts.append(rtt)
+            return list(rtts)
+
+    def discard(self, session_key):
+        with self._lock:
+            record = self._records.pop(session_key, None)
+        return record['rtts'] if record else []
+
+    def __contains__(self, session_key):
+        with self._lock:
+            record = self._records.get(session_key)
+            return record is not None and record['expires'] > self.clock()
+
+    def __len__(self):
+        return len(self._records)
+
+
+class CacheProbeStore(BaseProbeStore):
+    """Store backed by a Django cache for multi worker deployments.
+
+    The records are shared by all processes using the same cache, e.g.
+    memcached, so probes of a session may be handled by any worker. The
+    cache enforces the size bound and the ``ttl`` through its timeout.
+    Wall clock time is used, as monotonic clocks are not comparable across
+    processes.
+    """
+    clock = staticmethod(time.time)
+    blocking = True
+
+    def __init__(self, alias='default', key_prefix='rba_rtt_probe',
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.alias = alias
+        self.key_prefix = key_prefix
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _key(self, session_key):
+        return '%s:%s' % (self.key_prefix, session_key)
+
+    def _get(self, session_key):
+        record = self.cache.get(self._key(session_key))
+        if record is None:
+            raise KeyError(session_key)
+        return record
+
+    def _set(self, session_key, record):
+        self.cache.set(self._key(session_key), record, self.ttl)
+
+    def open(self, session_key):
+        self.cache.add(self._key(session_key),
+                       {'tokens': {}, 'rtts': []}, self.ttl)
+
+    def add(self, session_key, token, start_time):
+        record = self._get(session_key)
+        tokens = record['tokens']
+        tokens.setdefault(token, start_time)
+        while len(tokens) > self.max_tokens:
+            del tokens[next(iter(tokens))]
+        self._set(session_key, record)
+
+    def pop(self, session_key, token):
+        record = self._get(session_key)
+        start_time = record['tokens'].pop(token)
+        self._set(session_key, record)
+        if self.clock() - start_time > self.ttl:
+            raise KeyError(token)
+        return start_time
+
+    def append_rtt(self, session_key, rtt):
+        record = self._get(session_key)
+        record['rtts'].append(rtt)
+        self._set(session_key, record)
+        return list(record['rtts'])
+
+    def discard(self, session_key):
+        key = self._key(session_key)
+        record = self.cache.get(key)
+        self.cache.delete(key)
+        return record['rtts'] if record else []
+
+    def __contains__(self, session_key):
+        return self.cache.has_key(self._key(session_key))
+
+
+class ResultStore(object):
+    """Measured RTT results waiting to be consumed by the login form.
+
+    The statistics of a measurement are kept in a Django cache for ``ttl``
+    seconds under the session key, so the handoff from the consumer to the
+    form does not write the session.
+
+    ``wait`` is woken up by ``put`` of the same process and polls the cache
+    every ``poll_interval`` seconds for results stored by other processes.
+    """
+
+    def __init__(self, cache='default', ttl=300,
+                 key_prefix='rba_rtt_result', poll_interval=0.05):
+        self.alias = cache
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self.poll_interval = poll_interval
+        self._condition = threading.Condition()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _key(self, session_key):
+        return '%s:%s' % (self.key_prefix, session_key)
+
+    def put(self, session_key, stats):
+        self.cache.set(self._key(session_key), stats, self.ttl)
+        with self._condition:
+            self._condition.notify_all()
+
+    def has(self, session_key):
+        """Return whether a result of the session is waiting."""
+        return bool(session_key) and self.cache.has_key(
+            self._key(session_key))
+
+    def consume(self, session_key):
+        """Remove and return the result of a session, or None."""
+        if not session_key:
+            return None
+        key = self._key(session_key)
+        stats = self.cache.get(key)
+        if stats is not None:
+            self.cache.delete(key)
+        return stats
+
+    def wait(self, session_key, timeout):
+        """Consume the result of a session, waiting up to ``timeout``.
+
+        :returns: the statistics or None if none arrived in time.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            stats = self.consume(session_key)
+            remaining = deadline - time.monotonic()
+            if stats is not None or remaining <= 0:
+                return stats
+            with self._condition:
+                self._condition.wait(min(self.poll_interval, remaining))
+
+
+def create_probe_store():
+    config = getattr(settings, 'RBA_RTT_PROBE_STORE', DEFAULT_PROBE_STORE)
+    backend = import_string(config.get('BACKEND',
+                                       DEFAULT_PROBE_STORE['BACKEND']))
+    LOG.debug('Using %s as RTT probe store', backend.__name__)
+    return backend(**config.get('OPTIONS', {}))
+
+
+probe_store = SimpleLazyObject(create_probe_store)
+
+
+def create_result_store():
+    return ResultStore(**getattr(settings, 'RBA_RTT_RESULT_STORE', {}))
+
+
+result_store = SimpleLazyObject(create_result_store)
@@ -0,0 +1,177 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sampling profiler of slow logins.
+
+With ``RBA_PROFILING`` enabled, a ``SAMPLE_RATE`` fraction of the calls of
+a ``profiled`` function runs under cProfile. Calls taking at least
+``SLOW_THRESHOLD`` seconds are always reported. Every report consists of a
+JSON file with the durations of the ``metrics.timed`` stages of the call
+and, for sampled calls, a pstats dump next to it, e.g.::
+
+    python -m pstats /var/tmp/rba-profiles/20221004T101500-1234-ab12cd34.prof
+
+Only the newest ``MAX_FILES`` reports are kept in ``SPOOL_DIR``.
+
+Coroutine functions share their thread with every other task of the event
+loop, so cProfile cannot attribute its samples to one call. Sampled calls
+of coroutine functions are reported with their stage timings only.
+"""
+
+import asyncio
+import contextvars
+import cProfile
+import functools
+import json
+import logging
+import os
+import random
+import secrets
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from password_rba_horizon import metrics
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_PROFILING = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.01,
+    'SLOW_THRESHOLD': 2.0,
+    'SPOOL_DIR': '/var/tmp/rba-profiles',
+    'MAX_FILES': 100,
+}
+
+_current = contextvars.ContextVar('rba_profile', default=None)
+
+
+def _config():
+    config = dict(DEFAULT_PROFILING)
+    config.update(getattr(settings, 'RBA_PROFILING', {}))
+    return config
+
+
+def record_stage(stage, seconds):
+    """Stage hook of ``metrics.timed`` collecting the stages of a call."""
+    stages = _current.get()
+    if stages is not None:
+        stages.append((stage, seconds))
+
+
+metrics.STAGE_HOOKS.append(record_stage)
+
+
+def _prune(spool_dir, max_files):
+    reports = sorted((os.path.join(spool_dir, name)
+                      for name in os.listdir(spool_dir)
+                      if name.endswith('.json')), key=os.path.getmtime)
+    for path in reports[:max(0, len(reports) - max_files)]:
+        base = path[:-len('.json')]
+        for path in (base + '.json', base + '.prof'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def _dump(config, name, duration, stages, profile, sampled):
+    spool_dir = config['SPOOL_DIR']
+    os.makedirs(spool_dir, exist_ok=True)
+    base = os.path.join(spool_dir, '%s-%d-%s' % (
+        time.strftime('%Y%m%dT%H%M%S'), os.getpid(), secrets.token_hex(4)))
+    if profile is not None:
+        profile.dump_stats(base + '.prof')
+    report = {'name': name,
+              'duration': round(duration, 6),
+              'sampled': sampled,
+              'slow': duration >= config['SLOW_THRESHOLD'],
+              'stages': [[stage, round(seconds, 6)]
+                         for stage, seconds in stages]}
+    with open(base + '.json', 'w') as f:
+        json.dump(report, f)
+    _prune(spool_dir, config['MAX_FILES'])
+    LOG.info('Wrote profile of %s taking %.3fs to %s.json',
+             name, duration, base)
+
+
+def profiled(name):
+    """Decorator profiling the outermost call of a sampled request.
+
+    Nested ``profiled`` calls only contribute their stages to the report
+    of the outer call.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is not None:
+                return func(*args, **kwargs)
+            config = _config()
+            if not config['ENABLED']:
+                return func(*args, **kwargs)
+            profile = None
+            if random.random() < config['SAMPLE_RATE']:
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except ValueError:
+                    # Another thread is being profiled already.
+                    profile = None
+            stages = []
+            token = _current.set(stages)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                if profile is not None:
+                    profile.disable()
+                _current.reset(token)
+                if (profile is not None or
+                        duration >= config['SLOW_THRESHOLD']):
+                    try:
+                        _dump(config, name, duration, stages, profile,
+                              profile is not None)
+                    except (OSError, ValueError) as exc:
+                        LOG.warning('Unable to write profile: %s', exc)
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            if _current.get() is not None:
+                return await func(*args, **kwargs)
+            config = _config()
+            if not config['ENABLED']:
+                return await func(*args, **kwargs)
+            sampled = random.random() < config['SAMPLE_RATE']
+            stages = []
+            token = _current.set(stages)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                _current.reset(token)
+                if sampled or duration >= config['SLOW_THRESHOLD']:
+                    try:
+                        await sync_to_async(_dump, thread_sensitive=False)(
+                            config, name, duration, stages, None, sampled)
+                    except (OSError, ValueError) as exc:
+                        LOG.warning('Unable to write profile: %s', exc)
+
+        if asyncio.iscoroutinefunction(func):
+            return async_wrapper
+        return wrapper
+    return decorator
@@ -0,0 +1,148 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.functional import SimpleLazyObject
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_RATE_LIMIT = {
+    'ENABLED': False,
+    'OPTIONS': {},
+}
+
+DEFAULT_BUCKETS = {
+    'ip': {'rate': 0.5, 'burst': 10},
+    'username': {'rate': 0.2, 'burst': 5},
+    'global': {'rate': 50, 'burst': 200},
+}
+
+
+class TokenBucketLimiter(object):
+    """Rate limits per client IP, per username and global.
+
+    The limits are kept in a Django cache to be shared by all workers.
+    Every bucket admits ``burst`` attempts per window of ``burst / rate``
+    seconds, so ``rate`` attempts per second on average. The attempts of
+    the previous window are weighted by the part of it that still overlaps
+    a sliding window ending now.
+
+    An attempt is checked against all buckets before it is counted in any
+    of them, and is rejected if one of them is exhausted. The counters are
+    only changed by the atomic ``add``, ``incr`` and ``decr`` of the
+    cache, so concurrent attempts cannot exceed a limit.
+    """
+
+    def __init__(self, cache='default', key_prefix='rba_ratelimit',
+                 buckets=None):
+        self.alias = cache
+        self.key_prefix = key_prefix
+        self.buckets = buckets or DEFAULT_BUCKETS
+        self.clock = time.time
+        self._counters = collections.Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _key(self, bucket, ident):
+        digest = hashlib.sha256(ident.encode('utf-8')).hexdigest()[:32]
+        return '%s:%s:%s' % (self.key_prefix, bucket, digest)
+
+    def _count(self, bucket, result):
+        with self._lock:
+            self._counters[(bucket, result)] += 1
+
+    def _window(self, bucket, ident, now):
+        """Return the keys of the current and previous window of a bucket
+        and the weight of the previous window.
+        """
+        length = self.buckets[bucket]['burst'] / self.buckets[bucket]['rate']
+        index, elapsed = divmod(now, length)
+        key = self._key(bucket, ident)
+        return ('%s:%d' % (key, index), '%s:%d' % (key, index - 1),
+                1 - elapsed / length)
+
+    def _exceeded(self, bucket, current, previous, weight):
+        return current + previous * weight > self.buckets[bucket]['burst']
+
+    def _timeout(self, bucket):
+        # The counter of a window is read during the next one.
+        return int(2 * self.buckets[bucket]['burst'] /
+                   self.buckets[bucket]['rate']) + 1
+
+    def _reject(self, bucket, charged):
+        for key in charged:
+            self.cache.decr(key)
+        self._count(bucket, 'rejected')
+        LOG.info('Login attempt rejected by the %s rate limit.', bucket)
+        return False
+
+    def acquire(self, client_ip, username):
+        """Count a login attempt in every bucket.
+
+        :returns: False if the attempt has to be rejected.
+        """
+        idents = {'ip': client_ip, 'username': username, 'global': ''}
+        now = self.clock()
+        windows = {bucket: self._window(bucket, idents.get(bucket) or '', now)
+                   for bucket in self.buckets}
+        counts = self.cache.get_many(
+            [key for current, previous, _ in windows.values()
+             for key in (current, previous)])
+        for bucket, (current, previous, weight) in windows.items():
+            if self._exceeded(bucket, counts.get(current, 0) + 1,
+                              counts.get(previous, 0), weight):
+                return self._reject(bucket, ())
+        charged = []
+        for bucket, (current, previous, weight) in windows.items():
+            if self.cache.add(current, 1, self._timeout(bucket)):
+                count = 1
+            else:
+                count = self.cache.incr(current)
+            charged.append(current)
+            # Concurrent attempts may have passed the check above as well.
+            if self._exceeded(bucket, count, counts.get(previous, 0),
+                              weight):
+                return self._reject(bucket, charged)
+        for bucket in windows:
+            self._count(bucket, 'allowed')
+        return True
+
+    def stats(self):
+        """Return the counters as ``{(bucket, result): count}``."""
+        with self._lock:
+            return dict(self._counters)
+
+
+def rate_limit_enabled():
+    config = getattr(settings, 'RBA_RATE_LIMIT', DEFAULT_RATE_LIMIT)
+    return config.get('ENABLED', False)
+
+
+def create_limiter():
+    config = getattr(settings, 'RBA_RATE_LIMIT', DEFAULT_RATE_LIMIT)
+    return TokenBucketLimiter(**config.get('OPTIONS', {}))
+
+
+login_limiter = SimpleLazyObject(create_limiter)
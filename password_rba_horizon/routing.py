@@ -18,7 +18,12 @@ from django.urls import re_path
 
 from password_rba_horizon import consumers
 
+if getattr(settings, 'RBA_RTT_ASYNC_CONSUMER', False):
+    rtt_consumer = consumers.AsyncRoundTripTimeConsumer
+else:
+    rtt_consumer = consumers.RoundTripTimeConsumer
+
 websocket_urlpatterns = [
     re_path(r'^ws' + settings.LOGIN_URL,
-            consumers.RoundTripTimeConsumer.as_asgi()),
+            rtt_consumer.as_asgi()),
 ]
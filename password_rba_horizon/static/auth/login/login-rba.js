@@ -43,6 +43,28 @@ limitations under the License.
 		}
 	}
 
+    function resend(resendText) {
+		const csrfInput = form.querySelector("input[name='csrfmiddlewaretoken']");
+		fetch("/auth/rba/resend/", {
+		    method: "POST",
+		    credentials: "same-origin",
+		    headers: {"X-CSRFToken": csrfInput ? csrfInput.value : ""}
+		}).then((response) => {
+		    if (response.status === 200) {
+			resendText.innerText = "A new code has been sent. ";
+		    } else if (response.status === 429) {
+			resendText.innerText = "Please wait before requesting another code. ";
+		    } else {
+			// No pending challenge, start a new login attempt.
+			passcodeInput.disabled = "true";
+			loginBtn.click()
+		    }
+		}).catch(() => {
+		    passcodeInput.disabled = "true";
+		    loginBtn.click()
+		});
+	}
+
     let loginTitle = document.getElementsByClassName("login-title")[0]
     let loginBtn = document.getElementById("loginBtn");
     let passcodeInput = document.getElementById("id_passcode");
@@ -66,8 +88,7 @@ limitations under the License.
 	    resendButton.style.color = "blue";
 	    resendButton.style.cursor = "pointer";
 	    resendButton.onclick =  () => {
-			passcodeInput.disabled = "true";
-			loginBtn.click()
+			resend(resendText);
 	    }
 	    panelFooter.prepend(resendButton)
 	    panelFooter.prepend(resendText)
@@ -0,0 +1,98 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+from django.test import SimpleTestCase
+
+from keystoneauth1 import exceptions as keystone_exceptions
+
+from password_rba_horizon import circuit
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = circuit.CircuitBreaker(
+            'http://keystone', failure_threshold=3, recovery_timeout=30)
+        self.breaker.clock = lambda: self.now
+
+    def fail(self, exc):
+        with self.assertRaises(type(exc)):
+            with self.breaker.guard():
+                raise exc
+
+    def succeed(self):
+        with self.breaker.guard():
+            pass
+
+    def test_opens_after_threshold(self):
+        for _ in range(2):
+            self.fail(keystone_exceptions.ConnectFailure())
+        self.assertEqual(circuit.CLOSED, self.breaker.state)
+        self.fail(keystone_exceptions.ConnectFailure())
+        self.assertEqual(circuit.OPEN, self.breaker.state)
+        with self.assertRaises(circuit.CircuitOpenError):
+            self.succeed()
+
+    def test_timeouts_open(self):
+        for _ in range(3):
+            self.fail(keystone_exceptions.ConnectTimeout())
+        self.assertEqual(circuit.OPEN, self.breaker.state)
+        self.assertEqual(3, self.breaker.failures)
+
+    def test_server_errors_open(self):
+        for _ in range(3):
+            self.fail(keystone_exceptions.ServiceUnavailable())
+        self.assertEqual(circuit.OPEN, self.breaker.state)
+
+    def test_client_error_resets_failures(self):
+        self.fail(keystone_exceptions.ConnectTimeout())
+        self.fail(keystone_exceptions.Unauthorized())
+        self.assertEqual(0, self.breaker.failures)
+        self.assertEqual(circuit.CLOSED, self.breaker.state)
+
+    def test_half_open_success_closes(self):
+        for _ in range(3):
+            self.fail(keystone_exceptions.ConnectFailure())
+        self.now = 30
+        self.succeed()
+        self.assertEqual(circuit.CLOSED, self.breaker.state)
+        self.assertEqual(0, self.breaker.failures)
+
+    def test_half_open_failure_opens(self):
+        for _ in range(3):
+            self.fail(keystone_exceptions.ConnectFailure())
+        self.now = 30
+        self.fail(keystone_exceptions.ConnectTimeout())
+        self.assertEqual(circuit.OPEN, self.breaker.state)
+        self.assertEqual(30, self.breaker.opened_at)
+        with self.assertRaises(circuit.CircuitOpenError):
+            self.succeed()
+
+    def test_half_open_limits_trials(self):
+        for _ in range(3):
+            self.fail(keystone_exceptions.ConnectFailure())
+        self.now = 30
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+    def test_cancelled_trial_is_released(self):
+        for _ in range(3):
+            self.fail(keystone_exceptions.ConnectFailure())
+        self.now = 30
+        self.fail(asyncio.CancelledError())
+        self.assertEqual(circuit.HALF_OPEN, self.breaker.state)
+        self.succeed()
+        self.assertEqual(circuit.CLOSED, self.breaker.state)
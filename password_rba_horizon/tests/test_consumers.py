@@ -0,0 +1,142 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock
+
+from django.test import override_settings
+from django.test import SimpleTestCase
+
+from password_rba_horizon import consumers
+
+
+class ClientIPTests(SimpleTestCase):
+
+    def client_ip(self, headers=()):
+        consumer = consumers.RoundTripTimeConsumer()
+        consumer.scope = {'headers': list(headers),
+                          'client': ('192.0.2.1', 40000)}
+        return consumer.client_ip
+
+    def test_peer_address(self):
+        self.assertEqual('192.0.2.1', self.client_ip(
+            [(b'x-forwarded-for', b'198.51.100.1')]))
+
+    @override_settings(SECURE_PROXY_ADDR_HEADER='HTTP_X_FORWARDED_FOR')
+    def test_address_of_trusted_proxy(self):
+        self.assertEqual('198.51.100.1', self.client_ip(
+            [(b'x-forwarded-for', b'203.0.113.7, 198.51.100.1')]))
+
+    @override_settings(SECURE_PROXY_ADDR_HEADER='HTTP_X_FORWARDED_FOR')
+    def test_without_header(self):
+        self.assertEqual('192.0.2.1', self.client_ip())
+
+
+class MeasurementSettingsTests(SimpleTestCase):
+
+    def open_measurement(self):
+        consumer = consumers.RoundTripTimeConsumer()
+        consumer.scope = {'session': mock.Mock(session_key='session')}
+        consumer.round_trips = mock.Mock()
+        consumer.open_measurement()
+        return consumer
+
+    @override_settings(RBA_RTT_PROBE_COUNT=0, RBA_RTT_PIPELINE_DEPTH=0)
+    def test_one_probe_at_least(self):
+        consumer = self.open_measurement()
+        self.assertEqual(1, consumer.pending_probes())
+
+    @override_settings(RBA_RTT_PROBE_COUNT=4, RBA_RTT_PIPELINE_DEPTH=2)
+    def test_pipeline(self):
+        consumer = self.open_measurement()
+        self.assertEqual(2, consumer.pending_probes())
+        consumer.sent, consumer.received = 3, 2
+        self.assertEqual(1, consumer.pending_probes())
+
+    @override_settings(RBA_RTT_PROBE_COUNT=4, RBA_RTT_MIN_PROBES=10)
+    def test_min_probes_capped(self):
+        self.assertEqual(4, self.open_measurement().min_probes)
+
+
+@override_settings(RBA_RTT_TOKEN_MODE='signed')
+class SignedProbeTests(SimpleTestCase):
+
+    def setUp(self):
+        self.now = 10 ** 12
+        patcher = mock.patch.object(consumers.time, 'monotonic_ns',
+                                    lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.consumer = self.open_measurement()
+
+    def open_measurement(self, session_key='session'):
+        consumer = consumers.RoundTripTimeConsumer()
+        consumer.scope = {'session': mock.Mock(session_key=session_key)}
+        consumer.round_trips = mock.Mock(ttl=30)
+        consumer.open_measurement()
+        return consumer
+
+    def test_round_trip(self):
+        token, _ = self.consumer.new_probe()
+        self.now += 2500000
+        self.assertEqual(2.5, self.consumer.verify_probe(token))
+
+    def test_token_hides_clock(self):
+        self.now += 1000
+        token, _ = self.consumer.new_probe()
+        self.assertEqual('1000', token.split('.')[1])
+
+    def test_replay(self):
+        token, _ = self.consumer.new_probe()
+        self.consumer.verify_probe(token)
+        with self.assertRaises(KeyError):
+            self.consumer.verify_probe(token)
+
+    def test_replay_on_other_socket(self):
+        token, _ = self.consumer.new_probe()
+        self.now += 1000
+        other = self.open_measurement()
+        other.new_probe()
+        with self.assertRaises(KeyError):
+            other.verify_probe(token)
+
+    def test_other_session(self):
+        token, _ = self.consumer.new_probe()
+        other = self.open_measurement('other')
+        other.new_probe()
+        with self.assertRaises(KeyError):
+            other.verify_probe(token)
+
+    def test_forged_send_time(self):
+        token, _ = self.consumer.new_probe()
+        seq, start_time, mac = token.split('.')
+        self.now += 5000000
+        with self.assertRaises(KeyError):
+            self.consumer.verify_probe(
+                '%s.%d.%s' % (seq, int(start_time) + 4000000, mac))
+
+    def test_unsent_sequence(self):
+        token, _ = self.consumer.new_probe()
+        with self.assertRaises(KeyError):
+            self.consumer.verify_probe('1' + token[1:])
+
+    def test_malformed(self):
+        self.consumer.new_probe()
+        for text in ('', 'token', '0.x.y', None):
+            with self.assertRaises(KeyError):
+                self.consumer.verify_probe(text)
+
+    def test_expired(self):
+        token, _ = self.consumer.new_probe()
+        self.now += 31 * 10 ** 9
+        with self.assertRaises(KeyError):
+            self.consumer.verify_probe(token)
@@ -0,0 +1,82 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock
+
+from django.test import override_settings
+from django.test import SimpleTestCase
+
+from password_rba_horizon import endpoints
+
+AUTH_URL = 'http://keystone/v3'
+REPLICAS = ['http://keystone-1/v3', 'http://keystone-2/v3',
+            'http://keystone-3/v3']
+
+
+class EndpointPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.pool = endpoints.EndpointPool(REPLICAS, alpha=0.5)
+
+    def test_ordered_by_latency(self):
+        self.pool.report_success(REPLICAS[0], 0.3)
+        self.pool.report_success(REPLICAS[1], 0.1)
+        self.pool.report_success(REPLICAS[2], 0.2)
+        self.assertEqual([REPLICAS[1], REPLICAS[2], REPLICAS[0]],
+                         self.pool.ordered())
+
+    def test_unhealthy_last(self):
+        self.pool.report_success(REPLICAS[0], 0.1)
+        self.pool.report_success(REPLICAS[1], 0.2)
+        self.pool.report_success(REPLICAS[2], 0.3)
+        self.pool.report_failure(REPLICAS[0])
+        self.assertEqual([REPLICAS[1], REPLICAS[2], REPLICAS[0]],
+                         self.pool.ordered())
+        self.assertEqual(1, self.pool.stats()[REPLICAS[0]]['failures'])
+
+    def test_success_heals(self):
+        self.pool.report_failure(REPLICAS[0])
+        self.pool.report_success(REPLICAS[0])
+        stats = self.pool.stats()[REPLICAS[0]]
+        self.assertTrue(stats['healthy'])
+        self.assertEqual(0, stats['failures'])
+
+    def test_latency_is_smoothed(self):
+        self.pool.report_success(REPLICAS[0], 0.2)
+        self.pool.report_success(REPLICAS[0], 0.4)
+        self.assertAlmostEqual(0.3, self.pool.stats()[REPLICAS[0]]['latency'])
+
+    def test_login_keeps_latency(self):
+        self.pool.report_success(REPLICAS[0], 0.2)
+        self.pool.report_success(REPLICAS[0])
+        self.assertAlmostEqual(0.2, self.pool.stats()[REPLICAS[0]]['latency'])
+
+
+@mock.patch.object(endpoints.EndpointPool, 'start', mock.Mock())
+@mock.patch.dict(endpoints._pools, clear=True)
+class CandidatesTests(SimpleTestCase):
+
+    def test_without_replicas(self):
+        self.assertEqual(([AUTH_URL], None), endpoints.candidates(AUTH_URL))
+
+    @override_settings(RBA_KEYSTONE_ENDPOINTS={AUTH_URL: REPLICAS})
+    def test_one_retry(self):
+        urls, pool = endpoints.candidates(AUTH_URL)
+        self.assertEqual(REPLICAS[:2], urls)
+        self.assertIs(pool, endpoints.get_pool(AUTH_URL))
+
+    @override_settings(RBA_KEYSTONE_ENDPOINTS={AUTH_URL: REPLICAS},
+                       RBA_KEYSTONE_FAILOVER_RETRIES=0)
+    def test_no_retry(self):
+        urls, pool = endpoints.candidates(AUTH_URL)
+        self.assertEqual(REPLICAS[:1], urls)
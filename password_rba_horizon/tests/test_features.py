@@ -0,0 +1,62 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock
+
+from django.test import override_settings
+from django.test import SimpleTestCase
+
+from password_rba_horizon import features
+from password_rba_horizon import probes
+
+STATS = {'min': 20.0, 'median': 21.0, 'jitter': 0.5, 'count': 5}
+
+
+@mock.patch.object(probes, 'result_store')
+@mock.patch.object(probes, 'probe_store', new_callable=set)
+class RTTStatsTests(SimpleTestCase):
+
+    def rtt_stats(self, session_key='session'):
+        request = mock.Mock()
+        request.session.session_key = session_key
+        return features.FeatureContext(request).rtt_stats
+
+    def test_stored(self, probe_store, result_store):
+        result_store.consume.return_value = STATS
+        self.assertEqual(STATS, self.rtt_stats())
+        result_store.wait.assert_not_called()
+
+    def test_in_flight(self, probe_store, result_store):
+        probe_store.add('session')
+        result_store.consume.return_value = None
+        result_store.wait.return_value = STATS
+        self.assertEqual(STATS, self.rtt_stats())
+        result_store.wait.assert_called_once_with('session', 0.5)
+
+    def test_finished_between_lookups(self, probe_store, result_store):
+        result_store.consume.side_effect = [None, STATS]
+        self.assertEqual(STATS, self.rtt_stats())
+        result_store.wait.assert_not_called()
+
+    @override_settings(RBA_RTT_WAIT_TIMEOUT=0)
+    def test_no_wait(self, probe_store, result_store):
+        probe_store.add('session')
+        result_store.consume.return_value = None
+        self.assertIsNone(self.rtt_stats())
+        result_store.wait.assert_not_called()
+
+    def test_without_session(self, probe_store, result_store):
+        result_store.consume.return_value = None
+        self.assertIsNone(self.rtt_stats(None))
+        result_store.wait.assert_not_called()
+
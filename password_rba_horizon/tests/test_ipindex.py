@@ -0,0 +1,110 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+
+from django.test import SimpleTestCase
+
+from password_rba_horizon import ipindex
+
+CSV = '''prefix,asn,country
+10.0.0.0/8,AS100,DE
+10.1.0.0/16,AS200,FR
+10.1.2.0/24,300,
+192.0.2.0/24,AS400,us
+2001:db8::/32,AS500,NL
+2001:db8:1::/48,AS600,BE
+2001:db8:2::1/128,AS700,LU
+not a prefix,AS1,XX
+'''
+
+
+class FlattenTests(SimpleTestCase):
+
+    def test_disjoint(self):
+        self.assertEqual([(0, 9, 'a'), (20, 29, 'b')],
+                         ipindex._flatten([(20, 29, 'b'), (0, 9, 'a')]))
+
+    def test_nested_in_middle(self):
+        self.assertEqual([(0, 9, 'a'), (10, 19, 'b'), (20, 99, 'a')],
+                         ipindex._flatten([(0, 99, 'a'), (10, 19, 'b')]))
+
+    def test_nested_at_edges(self):
+        self.assertEqual([(0, 9, 'b'), (10, 89, 'a'), (90, 99, 'c')],
+                         ipindex._flatten([(0, 99, 'a'), (0, 9, 'b'),
+                                           (90, 99, 'c')]))
+
+    def test_deeply_nested(self):
+        self.assertEqual([(0, 9, 'a'), (10, 19, 'b'), (20, 29, 'c'),
+                          (30, 39, 'b'), (40, 99, 'a')],
+                         ipindex._flatten([(0, 99, 'a'), (10, 39, 'b'),
+                                           (20, 29, 'c')]))
+
+    def test_adjacent_nested(self):
+        self.assertEqual([(0, 9, 'b'), (10, 19, 'c'), (20, 99, 'a')],
+                         ipindex._flatten([(0, 99, 'a'), (0, 9, 'b'),
+                                           (10, 19, 'c')]))
+
+    def test_identical(self):
+        self.assertEqual(1, len(ipindex._flatten([(0, 9, 'a'),
+                                                  (0, 9, 'b')])))
+
+
+class IPIndexTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        csv_path = os.path.join(cls.tmpdir.name, 'ranges.csv')
+        index_path = os.path.join(cls.tmpdir.name, 'ranges.idx')
+        with open(csv_path, 'w') as f:
+            f.write(CSV)
+        cls.counts = ipindex.build(csv_path, index_path)
+        cls.index = ipindex.IPIndex(index_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        del cls.index
+        cls.tmpdir.cleanup()
+        super().tearDownClass()
+
+    def test_counts(self):
+        self.assertEqual((6, 4), self.counts)
+        self.assertEqual(10, len(self.index))
+
+    def test_ipv4(self):
+        self.assertEqual((100, 'DE'), self.index.lookup('10.0.0.1'))
+        self.assertEqual((200, 'FR'), self.index.lookup('10.1.0.1'))
+        self.assertEqual((300, ''), self.index.lookup('10.1.2.255'))
+        self.assertEqual((200, 'FR'), self.index.lookup('10.1.3.0'))
+        self.assertEqual((100, 'DE'), self.index.lookup('10.255.255.255'))
+        self.assertEqual((400, 'US'), self.index.lookup('192.0.2.7'))
+
+    def test_ipv6(self):
+        self.assertEqual((500, 'NL'), self.index.lookup('2001:db8::1'))
+        self.assertEqual((600, 'BE'), self.index.lookup('2001:db8:1::1'))
+        # Prefixes longer than /64 are widened to /64.
+        self.assertEqual((700, 'LU'), self.index.lookup('2001:db8:2::2'))
+        self.assertEqual((500, 'NL'), self.index.lookup('2001:db8:3::'))
+
+    def test_unknown(self):
+        self.assertIsNone(self.index.lookup('9.255.255.255'))
+        self.assertIsNone(self.index.lookup('11.0.0.0'))
+        self.assertIsNone(self.index.lookup('2001:db9::'))
+
+    def test_invalid(self):
+        self.assertIsNone(self.index.lookup('not an address'))
+        self.assertIsNone(self.index.lookup('10.0.0.256'))
+        self.assertIsNone(self.index.lookup(''))
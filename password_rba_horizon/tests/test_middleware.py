@@ -0,0 +1,52 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from importlib import import_module
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from password_rba_horizon import middleware
+
+
+class SessionKeyMiddlewareTests(SimpleTestCase):
+
+    def session_key(self, cookie=None):
+        scopes = []
+
+        async def inner(scope, receive, send):
+            scopes.append(scope)
+
+        headers = []
+        if cookie is not None:
+            headers.append((b'cookie', ('%s=%s' % (
+                settings.SESSION_COOKIE_NAME, cookie)).encode('latin1')))
+        asyncio.run(middleware.SessionKeyMiddleware(inner)(
+            {'type': 'websocket', 'headers': headers}, None, None))
+        return scopes[0]['session'].session_key
+
+    def test_existing_session(self):
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session.create()
+        self.assertEqual(session.session_key,
+                         self.session_key(session.session_key))
+
+    def test_unknown_session(self):
+        self.assertIsNone(self.session_key('abcdefghijklmnop'))
+
+    def test_malformed_session(self):
+        self.assertIsNone(self.session_key('abc'))
+
+    def test_without_cookie(self):
+        self.assertIsNone(self.session_key())
@@ -0,0 +1,109 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from unittest import mock
+
+from django.test import override_settings
+from django.test import SimpleTestCase
+
+from keystoneauth1 import exceptions as keystone_exceptions
+
+from openstack_auth import exceptions
+
+from password_rba_horizon import endpoints
+from password_rba_horizon import keystone
+from password_rba_horizon import plugin
+
+AUTH_URL = 'http://keystone/v3'
+REPLICAS = ['http://keystone-1/v3', 'http://keystone-2/v3']
+
+
+@override_settings(RBA_KEYSTONE_ENDPOINTS={AUTH_URL: REPLICAS},
+                   RBA_COALESCE_LOGINS=False)
+@mock.patch.object(endpoints.EndpointPool, 'start', mock.Mock())
+@mock.patch.object(keystone, 'get_session', mock.Mock())
+@mock.patch.dict(endpoints._pools, clear=True)
+class FailoverTests(SimpleTestCase):
+
+    def setUp(self):
+        self.plugin = plugin.RBAPasswordPlugin()
+        self.keystone_auth = mock.Mock(auth_url=AUTH_URL,
+                                       rba_session_key=None)
+        self.calls = []
+
+    def get_access(self, *errors):
+        def get_access(session):
+            self.calls.append(self.keystone_auth.auth_url)
+            if len(self.calls) <= len(errors):
+                raise errors[len(self.calls) - 1]
+            return mock.sentinel.auth_ref
+        self.keystone_auth.get_access.side_effect = get_access
+
+    def health(self, url):
+        return endpoints.get_pool(AUTH_URL).stats()[url]['healthy']
+
+    def test_fastest_replica_first(self):
+        endpoints.get_pool(AUTH_URL).report_success(REPLICAS[0], 0.2)
+        endpoints.get_pool(AUTH_URL).report_success(REPLICAS[1], 0.1)
+        self.get_access()
+        self.assertIs(mock.sentinel.auth_ref,
+                      self.plugin.get_access_info(self.keystone_auth))
+        self.assertEqual(REPLICAS[1:], self.calls)
+
+    def test_retry_after_timeout(self):
+        self.get_access(keystone_exceptions.ConnectTimeout())
+        self.assertIs(mock.sentinel.auth_ref,
+                      self.plugin.get_access_info(self.keystone_auth))
+        self.assertEqual(REPLICAS, self.calls)
+        self.assertFalse(self.health(REPLICAS[0]))
+        self.assertTrue(self.health(REPLICAS[1]))
+        self.assertEqual(REPLICAS[1], self.keystone_auth.auth_url)
+
+    def test_retry_after_connect_failure(self):
+        self.get_access(keystone_exceptions.ConnectFailure())
+        self.plugin.get_access_info(self.keystone_auth)
+        self.assertEqual(REPLICAS, self.calls)
+        self.assertFalse(self.health(REPLICAS[0]))
+
+    def test_no_retry_after_auth_error(self):
+        self.get_access(keystone_exceptions.Unauthorized())
+        with self.assertRaises(exceptions.KeystoneCredentialsException):
+            self.plugin.get_access_info(self.keystone_auth)
+        self.assertEqual(REPLICAS[:1], self.calls)
+        self.assertTrue(self.health(REPLICAS[0]))
+
+    def test_all_replicas_time_out(self):
+        self.get_access(keystone_exceptions.ConnectTimeout(),
+                        keystone_exceptions.ConnectTimeout())
+        with self.assertRaises(exceptions.KeystoneConnectionException):
+            self.plugin.get_access_info(self.keystone_auth)
+        self.assertEqual(REPLICAS, self.calls)
+
+    @mock.patch.object(plugin.RBAPasswordPlugin, '_token_request')
+    @mock.patch.object(plugin.RBAPasswordPlugin, '_apost')
+    def test_async_retry_after_timeout(self, apost, token_request):
+        if keystone.httpx is None:
+            self.skipTest('httpx is not installed')
+        token_request.side_effect = lambda auth, session: (
+            auth.auth_url + '/auth/tokens', {}, {})
+        response = mock.Mock(status_code=201,
+                             headers={'X-Subject-Token': 'token'})
+        response.json.return_value = {'token': {'methods': ['password']}}
+        apost.side_effect = [keystone_exceptions.ConnectTimeout(), response]
+        auth_ref = asyncio.run(
+            self.plugin.aget_access_info(self.keystone_auth))
+        self.assertEqual('token', auth_ref.auth_token)
+        self.assertEqual(REPLICAS[1] + '/auth/tokens',
+                         apost.call_args[0][0])
+        self.assertFalse(self.health(REPLICAS[0]))
@@ -0,0 +1,72 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from password_rba_horizon import probes
+
+STATS = {'min': 20.0, 'median': 21.0, 'jitter': 0.5, 'count': 5}
+
+
+class ResultStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.store = probes.ResultStore(poll_interval=5)
+
+    def put_later(self, put, delay=0.05):
+        timer = threading.Timer(delay, put)
+        timer.start()
+        self.addCleanup(timer.join)
+
+    def test_consume_once(self):
+        self.store.put('session', STATS)
+        self.assertTrue(self.store.has('session'))
+        self.assertEqual(STATS, self.store.consume('session'))
+        self.assertFalse(self.store.has('session'))
+        self.assertIsNone(self.store.consume('session'))
+
+    def test_without_session(self):
+        self.assertFalse(self.store.has(None))
+        self.assertIsNone(self.store.consume(None))
+
+    def test_wait_for_stored(self):
+        self.store.put('session', STATS)
+        self.assertEqual(STATS, self.store.wait('session', 0))
+
+    def test_wait_woken_by_put(self):
+        self.put_later(lambda: self.store.put('session', STATS))
+        start = time.monotonic()
+        self.assertEqual(STATS, self.store.wait('session', 5))
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_wait_polls_other_processes(self):
+        self.store.poll_interval = 0.01
+        self.put_later(lambda: cache.set(self.store._key('session'), STATS))
+        self.assertEqual(STATS, self.store.wait('session', 5))
+
+    def test_wait_timeout(self):
+        self.store.poll_interval = 0.01
+        start = time.monotonic()
+        self.assertIsNone(self.store.wait('session', 0.05))
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+    def test_wait_ignores_other_sessions(self):
+        self.store.poll_interval = 0.01
+        self.put_later(lambda: self.store.put('other', STATS))
+        self.assertIsNone(self.store.wait('session', 0.1))
+        self.assertEqual(STATS, self.store.consume('other'))
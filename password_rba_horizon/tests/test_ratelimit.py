@@ -0,0 +1,92 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from password_rba_horizon import ratelimit
+
+
+class TokenBucketLimiterTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.now = 1000.0
+        # A window of 10 seconds per bucket.
+        self.limiter = ratelimit.TokenBucketLimiter(buckets={
+            'ip': {'rate': 0.3, 'burst': 3},
+            'username': {'rate': 0.2, 'burst': 2},
+        })
+        self.limiter.clock = lambda: self.now
+
+    def acquire(self, ip='10.0.0.1', username='demo@Default'):
+        return self.limiter.acquire(ip, username)
+
+    def test_burst(self):
+        self.assertTrue(self.acquire())
+        self.assertTrue(self.acquire())
+        self.assertFalse(self.acquire())
+        self.assertEqual({('ip', 'allowed'): 2, ('username', 'allowed'): 2,
+                          ('username', 'rejected'): 1},
+                         self.limiter.stats())
+
+    def test_rejected_attempt_is_not_counted(self):
+        self.acquire(username='a')
+        self.acquire(username='a')
+        self.assertFalse(self.acquire(username='a'))
+        # The rejected attempt took nothing from the IP bucket.
+        self.assertTrue(self.acquire(username='b'))
+        self.assertFalse(self.acquire(username='c'))
+
+    def test_buckets_are_separate(self):
+        self.acquire(ip='10.0.0.1', username='a')
+        self.acquire(ip='10.0.0.1', username='a')
+        self.assertTrue(self.acquire(ip='10.0.0.2', username='b'))
+
+    def test_sliding_window(self):
+        self.acquire()
+        self.acquire()
+        # Half of the previous window overlaps the sliding window.
+        self.now += 15
+        self.assertTrue(self.acquire())
+        self.assertFalse(self.acquire())
+        self.now += 5
+        self.assertTrue(self.acquire())
+
+    def test_concurrent_attempts_recheck(self):
+        self.acquire()
+        self.acquire()
+        # Another worker read the counters before the attempts above.
+        with mock.patch.object(cache, 'get_many', return_value={}):
+            self.assertFalse(self.acquire())
+        ip = self.limiter._window('ip', '10.0.0.1', self.now)[0]
+        self.assertEqual(2, cache.get(ip))
+
+    def test_concurrent_burst(self):
+        self.limiter.buckets = {'global': {'rate': 1, 'burst': 20}}
+        results = []
+        barrier = threading.Barrier(50)
+
+        def attempt():
+            barrier.wait()
+            results.append(self.acquire())
+
+        threads = [threading.Thread(target=attempt) for _ in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(20, results.count(True))
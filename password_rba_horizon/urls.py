@@ -13,9 +13,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from django.conf import settings
+from django.urls import re_path
+
+from openstack_auth import urls
 from openstack_auth import views
 from password_rba_horizon.forms import Login
+from password_rba_horizon import views as rba_views
 
 
 views.forms.Login = Login
-urlpatterns = []
\ No newline at end of file
+urlpatterns = [
+    re_path(r'^rba/metrics/$', rba_views.metrics_view, name='rba_metrics'),
+    re_path(r'^rba/resend/$', rba_views.resend_passcode,
+            name='rba_resend_passcode'),
+    re_path(r'^rba/ready/$', rba_views.readiness, name='rba_readiness'),
+]
+
+# Take precedence over the login view of openstack_auth, which is included
+# before this module.
+if getattr(settings, 'RBA_ASGI_NATIVE_HTTP', False):
+    urls.urlpatterns.insert(
+        0, re_path(r'^login/$', rba_views.login, name='login'))
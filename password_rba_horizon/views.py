@@ -0,0 +1,87 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django import http
+from django.views.decorators.http import require_GET
+from django.views.decorators.http import require_POST
+
+from openstack_auth import utils
+from openstack_auth import views as oa_views
+
+from password_rba_horizon import challenges
+from password_rba_horizon import metrics
+from password_rba_horizon import plugin
+from password_rba_horizon import warmup
+
+
+@require_GET
+def metrics_view(request):
+    """Expose the metrics of this process in the Prometheus text format.
+
+    Requires ``RBA_METRICS_ENABLED``. ``RBA_METRICS_ALLOWED_IPS`` restricts
+    the access to the listed client addresses, only localhost by default.
+    An empty list or None allows every client.
+    """
+    if not getattr(settings, 'RBA_METRICS_ENABLED', False):
+        raise http.Http404()
+    allowed_ips = getattr(settings, 'RBA_METRICS_ALLOWED_IPS', ['127.0.0.1'])
+    if allowed_ips and utils.get_client_ip(request) not in allowed_ips:
+        return http.HttpResponseForbidden()
+    return http.HttpResponse(metrics.exposition(),
+                             content_type='text/plain; version=0.0.4')
+
+
+@require_POST
+def resend_passcode(request):
+    """Re-send the passcode of the pending challenge of the session.
+
+    The passcode is taken from the pending challenge, so no request to
+    keystone is required.
+    """
+    status = challenges.resend(request.session.session_key,
+                               plugin.RBAPasswordPlugin().send_passcode_email)
+    metrics.PASSCODE_RESENDS.inc(status)
+    codes = {challenges.SENT: 200,
+             challenges.THROTTLED: 429,
+             challenges.MISSING: 404}
+    return http.JsonResponse({'status': status}, status=codes[status])
+
+
+@require_GET
+def readiness(request):
+    """Report whether the warm-up of this worker finished.
+
+    Starts the warm-up if the deployment did not already.
+    """
+    warmup.start()
+    status = 200 if warmup.is_ready() else 503
+    return http.JsonResponse({'ready': warmup.is_ready(),
+                              'steps': warmup.results}, status=status)
+
+
+async def login(request):
+    """Asynchronous entry point of the login view.
+
+    Used with ``RBA_ASGI_NATIVE_HTTP``. The login of ``openstack_auth``
+    runs in the thread Django's ASGI handler bound to the request, which
+    also runs Horizon's synchronous middleware, instead of a second thread
+    of the bounded default executor. The request to keystone is awaited on
+    the event loop meanwhile.
+    """
+    plugin.keystone_on_loop.set(True)
+    return await sync_to_async(oa_views.login,
+                               thread_sensitive=True)(request)
@@ -0,0 +1,139 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Warm-up of a worker before it receives login traffic.
+
+Pays the cold costs of the first login ahead of time: the imports of the
+plugin stack, the URL resolution, Keystone version discovery on pooled
+connections, the import of the email backend and the start of the passcode
+outbox. No email connection is opened ahead of time, as mail servers drop
+idle connections. The readiness view reports the worker as ready once the
+warm-up finished.
+"""
+
+import importlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django import urls
+from django.utils.module_loading import import_string
+
+LOG = logging.getLogger(__name__)
+
+MODULES = (
+    'keystoneauth1.extras.rba',
+    'keystoneauth1.identity.v3',
+    'openstack_auth.backend',
+    'password_rba_horizon.forms',
+    'password_rba_horizon.plugin',
+    'password_rba_horizon.routing',
+)
+
+_ready = threading.Event()
+_started = False
+_lock = threading.Lock()
+results = {}
+
+
+def _auth_urls():
+    regions = getattr(settings, 'AVAILABLE_REGIONS', None) or []
+    auth_urls = [region[0] for region in regions]
+    if not auth_urls:
+        auth_urls.append(settings.OPENSTACK_KEYSTONE_URL)
+    return auth_urls
+
+
+def _imports():
+    for module in MODULES:
+        importlib.import_module(module)
+
+
+def _patterns():
+    from password_rba_horizon import features
+    from password_rba_horizon import plugin
+    plugin.PASSWORD_EXPIRED_PATTERN.match('')
+    plugin.ADDITIONAL_STEPS_PATTERN.match('')
+    features.get_extractors()
+
+
+def _routing():
+    from password_rba_horizon import routing
+    urls.resolve(settings.LOGIN_URL)
+    for pattern in routing.websocket_urlpatterns:
+        pattern.resolve('ws' + settings.LOGIN_URL)
+
+
+def _keystone():
+    from keystoneauth1 import discover
+    from password_rba_horizon import keystone
+    session = keystone.get_session()
+    for auth_url in _auth_urls():
+        discover.get_discovery(session, auth_url)
+
+
+def _email_backend():
+    import_string(settings.EMAIL_BACKEND)
+
+
+def _outbox():
+    from password_rba_horizon import outbox
+    if outbox.outbox_enabled():
+        outbox.passcode_outbox.start()
+
+
+STEPS = (
+    ('imports', _imports),
+    ('patterns', _patterns),
+    ('routing', _routing),
+    ('keystone', _keystone),
+    ('email_backend', _email_backend),
+    ('outbox', _outbox),
+)
+
+
+def warm_up():
+    """Run all warm-up steps and mark the worker as ready.
+
+    A failing step is logged and reported, but does not keep the worker
+    from becoming ready.
+    """
+    for name, step in STEPS:
+        start = time.perf_counter()
+        try:
+            step()
+        except Exception as exc:
+            LOG.warning('Warm-up step %s failed: %s', name, exc)
+            results[name] = {'ok': False, 'error': str(exc)}
+        else:
+            results[name] = {'ok': True}
+        results[name]['seconds'] = round(time.perf_counter() - start, 3)
+    _ready.set()
+    LOG.info('Worker warm-up finished.')
+
+
+def start():
+    """Start the warm-up in a background thread, once per process."""
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    threading.Thread(target=warm_up, name='rba-warm-up', daemon=True).start()
+
+
+def is_ready():
+    return _ready.is_set()
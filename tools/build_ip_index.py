@@ -0,0 +1,49 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Build the IP enrichment index of IPEnrichmentExtractor from a CSV file.
+
+The CSV file has ``prefix,asn,country`` rows, e.g.::
+
+    prefix,asn,country
+    192.0.2.0/24,AS64496,DE
+    2001:db8::/32,64497,NL
+
+Usage::
+
+    python tools/build_ip_index.py prefixes.csv /var/lib/horizon/ip.idx
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.normpath(os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), '..')))
+
+from password_rba_horizon import ipindex  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('csv', help='CSV file of prefix,asn,country rows')
+    parser.add_argument('index', help='index file to write')
+    args = parser.parse_args()
+    v4, v6 = ipindex.build(args.csv, args.index)
+    print('Wrote %d IPv4 and %d IPv6 ranges to %s' % (v4, v6, args.index))
+
+
+if __name__ == '__main__':
+    main()
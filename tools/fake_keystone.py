@@ -0,0 +1,305 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process stand-in of a Keystone with the RBA extension.
+
+Speaks enough of the identity v3 API for the ``RBAPasswordPlugin``:
+version discovery, the password+rba token request and the listing of the
+projects of the user. Depending on the configured users and the challenge
+rate, a login succeeds, is challenged with the "Additional authentications
+steps required" response carrying the contact and passcode, or fails
+because the password expired or the credentials are invalid::
+
+    python tools/fake_keystone.py --port 5000 \\
+        --user demo:secret:demo@example.com --challenge-rate 0.5
+
+Point ``OPENSTACK_KEYSTONE_URL`` to ``http://127.0.0.1:5000/v3``.
+"""
+
+import argparse
+import datetime
+import http.server
+import json
+import random
+import secrets
+import threading
+import time
+import uuid
+
+
+def _timestamp(delta=0):
+    value = datetime.datetime.utcnow() + datetime.timedelta(seconds=delta)
+    return value.strftime('%Y-%m-%dT%H:%M:%S.000000Z')
+
+
+class FakeKeystone(object):
+    """State and behaviour of the fake identity service.
+
+    :param users: dict of ``name -> {'password', 'email', 'expired'}``.
+    :param challenge_rate: probability that a login without passcode is
+        challenged.
+    :param delay: seconds added to every response, plus up to ``jitter``.
+    :param error_rate: probability of a 503 response.
+    :param drop_rate: probability that the connection is closed without a
+        response, which keystoneauth reports as a connect failure.
+    """
+
+    def __init__(self, users=None, project='demo', challenge_rate=0.0,
+                 delay=0.0, jitter=0.0, error_rate=0.0, drop_rate=0.0):
+        self.users = users or {}
+        self.project = project
+        self.challenge_rate = challenge_rate
+        self.delay = delay
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.passcodes = {}
+        self.tokens = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def user_id(self, name):
+        return uuid.uuid5(uuid.NAMESPACE_URL, name).hex
+
+    def token(self, name, methods, scoped=False, base_url=''):
+        token = {'methods': methods,
+                 'user': {'id': self.user_id(name), 'name': name,
+                          'domain': {'id': 'default', 'name': 'Default'},
+                          'password_expires_at': None},
+                 'audit_ids': [secrets.token_urlsafe(16)],
+                 'issued_at': _timestamp(),
+                 'expires_at': _timestamp(3600)}
+        if scoped:
+            token['project'] = {'id': self.user_id(self.project),
+                                'name': self.project,
+                                'domain': {'id': 'default',
+                                           'name': 'Default'}}
+            token['roles'] = [{'id': self.user_id('member'),
+                               'name': 'member'}]
+            token['catalog'] = [{
+                'type': 'identity', 'name': 'keystone',
+                'id': self.user_id('keystone'),
+                'endpoints': [{'id': self.user_id(interface),
+                               'interface': interface,
+                               'region': 'RegionOne',
+                               'region_id': 'RegionOne',
+                               'url': base_url + '/v3'}
+                              for interface in ('public', 'internal',
+                                                'admin')]}]
+        return token
+
+    def authenticate(self, body):
+        """Return the status, body and subject token of a token request."""
+        identity = body.get('auth', {}).get('identity', {})
+        methods = identity.get('methods', [])
+        if 'token' in methods:
+            name = self.tokens.get(identity['token'].get('id'))
+            if name is None:
+                return 404, self.error(404, 'Could not find token.'), None
+            return 201, None, name
+        user = identity.get('password', {}).get('user', {})
+        name = user.get('name')
+        account = self.users.get(name)
+        if account is None or account['password'] != user.get('password'):
+            return 401, self.error(
+                401, 'The request you have made requires authentication.'
+            ), None
+        if account.get('expired'):
+            return 401, self.error(
+                401, 'The password is expired and needs to be changed for '
+                'user: %s.' % self.user_id(name)), None
+        if 'rba' in methods:
+            rba = identity.get('rba', {})
+            passcode = rba.get('passcode')
+            with self._lock:
+                expected = self.passcodes.get(name)
+                if passcode and passcode == expected:
+                    del self.passcodes[name]
+                elif passcode or random.random() < self.challenge_rate:
+                    expected = ''.join(random.choice('0123456789')
+                                       for _ in range(6))
+                    self.passcodes[name] = expected
+                    error = self.error(
+                        401, 'Additional authentications steps required.')
+                    error['error']['identity'] = {
+                        'rba': {'contact': account.get('email', ''),
+                                'passcode': expected}}
+                    return 401, error, None
+        return 201, None, name
+
+    def error(self, code, message):
+        titles = {401: 'Unauthorized', 404: 'Not Found',
+                  503: 'Service Unavailable'}
+        return {'error': {'code': code, 'title': titles.get(code, 'Error'),
+                          'message': message}}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def keystone(self):
+        return self.server.keystone
+
+    @property
+    def base_url(self):
+        return 'http://%s:%d' % self.server.server_address[:2]
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _inject(self):
+        """Apply the configured delay and faults.
+
+        :returns: False if the request must not be answered.
+        """
+        keystone = self.keystone
+        with keystone._lock:
+            keystone.requests += 1
+        time.sleep(keystone.delay + random.random() * keystone.jitter)
+        if random.random() < keystone.drop_rate:
+            self.close_connection = True
+            self.connection.close()
+            return False
+        if random.random() < keystone.error_rate:
+            self._reply(503, keystone.error(503, 'Service unavailable.'))
+            return False
+        return True
+
+    def _reply(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _version(self):
+        return {'id': 'v3.14', 'status': 'stable',
+                'updated': '2020-04-07T00:00:00Z',
+                'links': [{'rel': 'self', 'href': self.base_url + '/v3/'}],
+                'media-types': [{
+                    'base': 'application/json',
+                    'type': 'application/vnd.openstack.identity-v3+json'}]}
+
+    def do_GET(self):
+        if not self._inject():
+            return
+        path = self.path.split('?', 1)[0].rstrip('/')
+        if path == '':
+            self._reply(300, {'versions': {'values': [self._version()]}})
+        elif path == '/v3':
+            self._reply(200, {'version': self._version()})
+        elif path in ('/v3/auth/projects', '/v3/auth/domains') or (
+                path.startswith('/v3/users/') and
+                path.endswith('/projects')):
+            key = path.rsplit('/', 1)[1]
+            values = []
+            if key == 'projects':
+                values.append({'id': self.keystone.user_id(
+                    self.keystone.project), 'name': self.keystone.project,
+                    'domain_id': 'default', 'enabled': True})
+            self._reply(200, {key: values, 'links': {}})
+        else:
+            self._reply(404, self.keystone.error(404, 'Not found.'))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if not self._inject():
+            return
+        if self.path.split('?', 1)[0].rstrip('/') != '/v3/auth/tokens':
+            self._reply(404, self.keystone.error(404, 'Not found.'))
+            return
+        status, error, name = self.keystone.authenticate(body)
+        if error is not None:
+            self._reply(status, error)
+            return
+        scope = body['auth'].get('scope')
+        methods = body['auth']['identity']['methods']
+        subject = secrets.token_hex(16)
+        self.keystone.tokens[subject] = name
+        self._reply(201, {'token': self.keystone.token(
+            name, methods, scoped=bool(scope) and scope != 'unscoped',
+            base_url=self.base_url)}, {'X-Subject-Token': subject})
+
+
+def serve(keystone, host='127.0.0.1', port=5000, verbose=False):
+    """Start the fake in a daemon thread and return the server."""
+    server = http.server.ThreadingHTTPServer((host, port), Handler)
+    server.keystone = keystone
+    server.verbose = verbose
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def parse_user(value):
+    """Parse ``name:password[:email[:expired]]``."""
+    parts = value.split(':')
+    if len(parts) < 2:
+        raise argparse.ArgumentTypeError('expected name:password[:email]')
+    return parts[0], {'password': parts[1],
+                      'email': parts[2] if len(parts) > 2 else '',
+                      'expired': len(parts) > 3 and parts[3] == 'expired'}
+
+
+def add_arguments(parser, prefix=''):
+    parser.add_argument('--%suser' % prefix, dest='keystone_users',
+                        action='append', type=parse_user, default=[],
+                        help='name:password[:email[:expired]]')
+    parser.add_argument('--%schallenge-rate' % prefix, type=float,
+                        dest='keystone_challenge_rate', default=0.0)
+    parser.add_argument('--%sdelay' % prefix, type=float,
+                        dest='keystone_delay', default=0.0,
+                        help='seconds added to every response')
+    parser.add_argument('--%sjitter' % prefix, type=float,
+                        dest='keystone_jitter', default=0.0)
+    parser.add_argument('--%serror-rate' % prefix, type=float,
+                        dest='keystone_error_rate', default=0.0)
+    parser.add_argument('--%sdrop-rate' % prefix, type=float,
+                        dest='keystone_drop_rate', default=0.0)
+
+
+def from_arguments(args):
+    return FakeKeystone(users=dict(args.keystone_users),
+                        challenge_rate=args.keystone_challenge_rate,
+                        delay=args.keystone_delay,
+                        jitter=args.keystone_jitter,
+                        error_rate=args.keystone_error_rate,
+                        drop_rate=args.keystone_drop_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--verbose', action='store_true')
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = serve(from_arguments(args), args.host, args.port, args.verbose)
+    print('Fake Keystone listening on http://%s:%d/v3' %
+          server.server_address[:2])
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
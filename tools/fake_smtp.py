@@ -0,0 +1,170 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Capturing SMTP server for the passcode emails.
+
+Accepts every message, optionally after a delay or with a temporary
+failure, and keeps it in memory instead of delivering it::
+
+    python tools/fake_smtp.py --port 1025 --delay 0.2 --failure-rate 0.1
+
+Configure ``EMAIL_HOST = '127.0.0.1'`` and ``EMAIL_PORT = 1025``.
+"""
+
+import argparse
+import random
+import socketserver
+import threading
+import time
+
+
+class FakeSMTP(object):
+    """Captured messages and the fault injection of the fake.
+
+    :param delay: seconds before the reply to ``DATA``, plus up to
+        ``jitter``.
+    :param failure_rate: probability that a message is answered with a
+        temporary failure.
+    """
+
+    def __init__(self, delay=0.0, jitter=0.0, failure_rate=0.0,
+                 verbose=False):
+        self.delay = delay
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.verbose = verbose
+        self.messages = []
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def capture(self, sender, recipients, data):
+        with self._lock:
+            self.messages.append({'from': sender, 'to': recipients,
+                                  'data': data, 'time': time.time()})
+        if self.verbose:
+            print('Message from %s to %s:\n%s' % (
+                sender, ', '.join(recipients), data))
+
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        smtp = self.server.smtp
+        with smtp._lock:
+            smtp.connections += 1
+        self.reply('220 fake-smtp ESMTP ready')
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                self.reply('250-fake-smtp')
+                self.reply('250-AUTH PLAIN LOGIN')
+                self.reply('250 8BITMIME')
+            elif verb == 'HELO':
+                self.reply('250 fake-smtp')
+            elif verb == 'AUTH':
+                if command.upper().startswith('AUTH LOGIN'):
+                    for _ in command.split(' ')[2:] or [None, None]:
+                        self.reply('334 VXNlcm5hbWU6')
+                        self.rfile.readline()
+                self.reply('235 Authentication successful')
+            elif verb == 'MAIL':
+                sender, recipients = command[10:].strip('<> '), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command[8:].strip('<> '))
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    line = self.rfile.readline()
+                    if not line or line in (b'.\r\n', b'.\n'):
+                        break
+                    if line.startswith(b'..'):
+                        line = line[1:]
+                    lines.append(line)
+                time.sleep(smtp.delay + random.random() * smtp.jitter)
+                if random.random() < smtp.failure_rate:
+                    self.reply('451 Temporary failure, try again later')
+                else:
+                    smtp.capture(sender, recipients,
+                                 b''.join(lines).decode('utf-8', 'replace'))
+                    self.reply('250 OK queued')
+                sender, recipients = None, []
+            elif verb == 'RSET':
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def serve(smtp, host='127.0.0.1', port=1025):
+    """Start the fake in a daemon thread and return the server."""
+    server = Server((host, port), Handler)
+    server.smtp = smtp
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def add_arguments(parser, prefix=''):
+    parser.add_argument('--%sdelay' % prefix, type=float, dest='smtp_delay',
+                        default=0.0, help='seconds before accepting a message')
+    parser.add_argument('--%sjitter' % prefix, type=float,
+                        dest='smtp_jitter', default=0.0)
+    parser.add_argument('--%sfailure-rate' % prefix, type=float,
+                        dest='smtp_failure_rate', default=0.0)
+
+
+def from_arguments(args, verbose=False):
+    return FakeSMTP(delay=args.smtp_delay, jitter=args.smtp_jitter,
+                    failure_rate=args.smtp_failure_rate, verbose=verbose)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1025)
+    parser.add_argument('--verbose', action='store_true')
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = serve(from_arguments(args, args.verbose), args.host, args.port)
+    print('Fake SMTP listening on %s:%d' % server.server_address[:2])
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
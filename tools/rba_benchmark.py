@@ -0,0 +1,290 @@
+# Copyright 2022 Vincent Unsel
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Load benchmark of the RBA login flow.
+
+Drives the ASGI application of the dashboard in-process. Every simulated
+client loads the login page, measures the RTT over the WebSocket of
+``routing.websocket_urlpatterns`` and posts the ``forms.Login`` form. The
+latency percentiles are written as JSON, e.g.::
+
+    DJANGO_SETTINGS_MODULE=openstack_dashboard.settings \\
+    python tools/rba_benchmark.py --clients 200 --concurrency 50 \\
+        --username demo --password secret --output run.json
+
+A previous result can be passed with ``--baseline`` to fail the run on
+latency regressions. With ``--fake-keystone-port`` and ``--fake-smtp-port``
+the stand-ins of ``fake_keystone.py`` and ``fake_smtp.py`` are started
+in-process, the settings have to point Keystone and the email host there.
+All clients share ``--client-ip``, so ``RBA_RTT_MAX_SOCKETS_PER_IP`` has to
+be at least ``--concurrency``.
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import re
+import sys
+import time
+import tracemalloc
+import urllib.parse
+
+from asgiref.testing import ApplicationCommunicator
+
+import fake_keystone
+import fake_smtp
+
+CSRF_PATTERN = re.compile(
+    r'name="csrfmiddlewaretoken" value="([^"]+)"')
+CHALLENGE_PATTERN = re.compile(r'id="id_passcode"[^>]*type="text"|'
+                               r'type="text"[^>]*id="id_passcode"')
+
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+
+    def rank(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {'count': len(ordered),
+            'p50': round(rank(0.50), 2),
+            'p95': round(rank(0.95), 2),
+            'p99': round(rank(0.99), 2),
+            'max': round(ordered[-1], 2)}
+
+
+def store_size(store):
+    """Approximate the bytes held by the records of a probe store."""
+    records = getattr(store, '_records', None)
+    if records is None:
+        return None
+    size = sys.getsizeof(records)
+    for session_key, record in list(records.items()):
+        size += sys.getsizeof(session_key) + sys.getsizeof(record)
+        for token, start_time in list(record['tokens'].items()):
+            size += sys.getsizeof(token) + sys.getsizeof(start_time)
+        size += sys.getsizeof(record['rtts'])
+    return size
+
+
+class Client(object):
+
+    def __init__(self, application, args):
+        self.application = application
+        self.args = args
+        self.cookies = {}
+
+    def _headers(self, extra=()):
+        headers = [(b'host', self.args.host.encode()),
+                   (b'origin', ('http://%s' % self.args.host).encode())]
+        if self.cookies:
+            cookie = '; '.join('%s=%s' % item for item in self.cookies.items())
+            headers.append((b'cookie', cookie.encode()))
+        headers.extend(extra)
+        return headers
+
+    async def http(self, method, path, body=b'', headers=()):
+        scope = {'type': 'http', 'http_version': '1.1', 'method': method,
+                 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+                 'query_string': b'', 'root_path': '',
+                 'headers': self._headers(headers),
+                 'client': (self.args.client_ip, 50000),
+                 'server': (self.args.host, 80)}
+        communicator = ApplicationCommunicator(self.application, scope)
+        await communicator.send_input({'type': 'http.request', 'body': body})
+        start = await communicator.receive_output(self.args.timeout)
+        content = b''
+        while True:
+            message = await communicator.receive_output(self.args.timeout)
+            content += message.get('body', b'')
+            if not message.get('more_body', False):
+                break
+        for name, value in start.get('headers', []):
+            if name.lower() == b'set-cookie':
+                morsel = value.decode().split(';', 1)[0]
+                key, _, val = morsel.partition('=')
+                self.cookies[key.strip()] = val.strip()
+        return start['status'], content.decode('utf-8', 'replace')
+
+    async def measure_rtt(self):
+        scope = {'type': 'websocket', 'path': '/ws' + self.args.login_url,
+                 'query_string': b'', 'headers': self._headers(),
+                 'subprotocols': [],
+                 'client': (self.args.client_ip, 50000),
+                 'server': (self.args.host, 80)}
+        communicator = ApplicationCommunicator(self.application, scope)
+        await communicator.send_input({'type': 'websocket.connect'})
+        while True:
+            message = await communicator.receive_output(self.args.timeout)
+            if message['type'] == 'websocket.send':
+                await communicator.send_input({'type': 'websocket.receive',
+                                               'text': message['text']})
+            elif message['type'] == 'websocket.close':
+                await communicator.send_input({'type': 'websocket.disconnect',
+                                               'code': 1000})
+                await communicator.wait(self.args.timeout)
+                return
+
+    async def login(self, results):
+        status, page = await self.http('GET', self.args.login_url)
+        match = CSRF_PATTERN.search(page)
+        start = time.perf_counter()
+        await self.measure_rtt()
+        results['rtt_ready'].append((time.perf_counter() - start) * 1000)
+        form = {'csrfmiddlewaretoken': match.group(1) if match else '',
+                'username': self.args.username,
+                'password': self.args.password,
+                'region': self.args.region,
+                'domain': self.args.domain,
+                'passcode': ''}
+        body = urllib.parse.urlencode(form).encode()
+        headers = [(b'content-type', b'application/x-www-form-urlencoded'),
+                   (b'referer', ('http://%s%s' % (
+                       self.args.host, self.args.login_url)).encode())]
+        start = time.perf_counter()
+        status, page = await self.http('POST', self.args.login_url, body,
+                                       headers)
+        elapsed = (time.perf_counter() - start) * 1000
+        if CHALLENGE_PATTERN.search(page):
+            results['login_challenged'].append(elapsed)
+        else:
+            results['login'].append(elapsed)
+        results['status'][str(status)] = results['status'].get(
+            str(status), 0) + 1
+
+
+async def sample_store(store, results, interval):
+    while True:
+        results['round_trips_peak_entries'] = max(
+            results['round_trips_peak_entries'], len(store))
+        size = store_size(store)
+        if size is not None:
+            results['round_trips_peak_bytes'] = max(
+                results['round_trips_peak_bytes'], size)
+        await asyncio.sleep(interval)
+
+
+async def run(application, store, args):
+    results = {'rtt_ready': [], 'login': [], 'login_challenged': [],
+               'status': {}, 'errors': 0,
+               'round_trips_peak_entries': 0, 'round_trips_peak_bytes': 0}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one():
+        async with semaphore:
+            try:
+                await Client(application, args).login(results)
+            except Exception:
+                results['errors'] += 1
+
+    sampler = asyncio.ensure_future(sample_store(store, results, 0.01))
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.clients)))
+    duration = time.perf_counter() - start
+    sampler.cancel()
+    return results, duration
+
+
+def compare(report, baseline, threshold):
+    regressions = []
+    for stage in ('rtt_ready', 'login', 'login_challenged'):
+        for quantile in ('p50', 'p95', 'p99'):
+            old = baseline.get(stage, {}).get(quantile)
+            new = report.get(stage, {}).get(quantile)
+            if old and new and new > old * (1 + threshold):
+                regressions.append('%s %s: %.2f ms -> %.2f ms' % (
+                    stage, quantile, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--asgi', default='openstack_dashboard.asgi',
+                        help='module providing the ASGI application')
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--username', default='demo')
+    parser.add_argument('--password', default='secret')
+    parser.add_argument('--domain', default='Default')
+    parser.add_argument('--region', default='default')
+    parser.add_argument('--login-url', default='/auth/login/')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--client-ip', default='127.0.0.1')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--output', help='write the JSON report to a file')
+    parser.add_argument('--baseline', help='JSON report to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='tolerated relative latency increase')
+    parser.add_argument('--fake-keystone-port', type=int,
+                        help='start the fake Keystone on this port')
+    parser.add_argument('--fake-smtp-port', type=int,
+                        help='start the fake SMTP server on this port')
+    fake_keystone.add_arguments(parser, prefix='keystone-')
+    fake_smtp.add_arguments(parser, prefix='smtp-')
+    args = parser.parse_args()
+
+    keystone = smtp = None
+    if args.fake_keystone_port:
+        if not args.keystone_users:
+            args.keystone_users = [(args.username, {
+                'password': args.password, 'email': 'demo@example.com'})]
+        keystone = fake_keystone.from_arguments(args)
+        fake_keystone.serve(keystone, port=args.fake_keystone_port)
+    if args.fake_smtp_port:
+        smtp = fake_smtp.from_arguments(args)
+        fake_smtp.serve(smtp, port=args.fake_smtp_port)
+
+    tracemalloc.start()
+    application = importlib.import_module(args.asgi).application
+    from password_rba_horizon import consumers
+    store = consumers.RoundTripTimeConsumer.round_trips
+
+    results, duration = asyncio.run(run(application, store, args))
+    report = {'clients': args.clients,
+              'concurrency': args.concurrency,
+              'duration_s': round(duration, 3),
+              'throughput_rps': round(args.clients / duration, 2),
+              'rtt_ready': percentiles(results['rtt_ready']),
+              'login': percentiles(results['login']),
+              'login_challenged': percentiles(results['login_challenged']),
+              'status': results['status'],
+              'errors': results['errors'],
+              'round_trips_peak_entries': results['round_trips_peak_entries'],
+              'round_trips_peak_bytes': results['round_trips_peak_bytes'],
+              'tracemalloc_peak_bytes': tracemalloc.get_traced_memory()[1]}
+    if keystone is not None:
+        report['keystone_requests'] = keystone.requests
+    if smtp is not None:
+        report['smtp_messages'] = len(smtp.messages)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for regression in regressions:
+            print('Regression: %s' % regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()